@@ -0,0 +1,184 @@
+"""Benchmarks of the integrators, to track their cost and accuracy from one revision to the next.
+
+Each case is integrated by each integrator over a sweep of timesteps and ensemble sizes.  A run measures the wall time, the number of derivatives evaluated, the weak error, which is the largest difference between the recorded mean and the exact moment at the sampling times, and, where the exact solution along the same Wiener path is known, the strong error, which is the mean difference between the elements and that solution at the end of the run.  The adaptive integrator follows a path of its own, so it has no strong error.  Cases without exact moments are compared with the run at the smallest timestep.
+
+The results are rows of plain numbers, written as JSON.
+
+Example:
+from benchmark import *
+rows = run_benchmarks([kubo_case()], standard_integrators(), [0.1, 0.05, 0.02], [1000, 10000])
+write_results(rows, 'benchmark.json')
+print_rows(regressions(read_results('baseline.json'), rows))
+
+The Fermi-Hubbard case needs the physics directory on the path.  Running this file does the standard sweep, and writes benchmark.json.
+"""
+
+from dynamics import *
+from integration import *
+from kubo import *
+import json
+import platform
+import numpy
+from time import time as wall_clock
+
+
+class kubo_case(object):
+
+	"""A Kubo oscillator, whose moments and paths are known exactly.  The noise is a counterNoise on the grid of the timestep, and the exact values are the solution along the Wiener path made of its increments, which the integrators converge to as the timestep shrinks."""
+
+	name = 'kubo'
+	method = 'amplitude_moment'
+
+	def __init__(self, frequency = 0.5, amplitude = 1.5, duration = 2, sample_time = 0.5, seed = 11):
+		self.system = KuboOscillator(frequency)
+		self.amplitude = amplitude
+		self.duration, self.sample_time, self.seed = duration, sample_time, seed
+
+	def prepare(self, size, timestep):
+		state = KuboAmplitudes(self.system, size)
+		state.set_amplitude(self.amplitude)
+		state.noise = counterNoise(self.seed, timestep)
+		return state
+
+	def exact(self, times):
+		return self.system.moment(self.amplitude, 1, 0, times)
+
+	def final_values(self, state):
+		return state.representations
+
+	def exact_values(self, size, timestep):
+		return self.prepare(size, timestep).sample_exactly([self.duration])[0]
+
+
+class fermi_case(object):
+
+	"""A Fermi-Hubbard grid, at half filling.  There are no exact moments, so the mean greens function is compared with that at the smallest timestep."""
+
+	name = 'fermi_hubbard'
+	method = 'greens_moment'
+
+	def __init__(self, sites = (2, 2), repulsion = 0.5, hopping = 0.3, chemical_potential = 0.1, duration = 1, sample_time = 0.5, seed = 12):
+		from fermi_hubbard import GreensFermiHubbard
+		self.system = GreensFermiHubbard(sites = sites, repulsion = repulsion, hopping = hopping, chemical_potential = chemical_potential)
+		self.duration, self.sample_time, self.seed = duration, sample_time, seed
+		self.name = 'fermi_hubbard_' + 'x'.join(str(n) for n in sites)
+
+	def prepare(self, size, timestep):
+		from fermi_hubbard import FermiHubbardGreens
+		state = FermiHubbardGreens(self.system, size)
+		state.set_filling(0.5)
+		state.noise = counterNoise(self.seed, timestep)
+		return state
+
+	def exact(self, times):
+		return None
+
+	def exact_values(self, size, timestep):
+		return None
+
+
+def standard_integrators():
+	"Answer pairs of a name and a function of the timestep that makes an integrator"
+	return [
+		('semi_implicit', semi_implicit_integrator),
+		('semi_implicit_2', lambda h: semi_implicit_integrator(h, iterations = 2)),
+		('semi_implicit_tolerance', lambda h: semi_implicit_integrator(h, tolerance = 1e-10, iterations = 8)),
+		('adaptive', lambda h: adaptive_integrator(h, 1e-2)),
+		('exact', lambda h: integrate_exactly)]
+
+
+def counting(state):
+	"Make state count the derivatives evaluated by it and its spares, in the class attribute evaluations"
+	base = type(state)
+	class counted(base):
+		evaluations = 0
+		def derivative(self, noise):
+			counted.evaluations += 1
+			return base.derivative(self, noise)
+	state.__class__ = counted
+	return state
+
+
+def run_benchmark(case, name, integrator, timestep, size):
+	"""Integrate case once, and answer a row of results, with the mean moments at the sampling times under the key means.
+
+	A case that cannot be integrated this way, such as one without an exact solution for integrate_exactly, answers None.  The adaptive integrator refines the Wiener path of each step, so it is given a bridgeNoise instead of the noise of the case."""
+	state = counting(case.prepare(size, timestep))
+	if isinstance(integrator, adaptive_integrator):
+		state.noise = bridgeNoise(case.seed)
+	if integrator is integrate_exactly and not hasattr(state, 'advanced_exactly'):
+		return None
+	results = record(case.sample_time, [case.method])
+	start = wall_clock()
+	integrator(state, case.duration, results)
+	seconds = wall_clock() - start
+	moments = results.results[case.method]
+	times = sorted(moments.keys())
+	row = {'case': case.name, 'integrator': name, 'timestep': timestep, 'size': size, 'seconds': seconds, 'derivatives': type(state).evaluations, 'means': dict((t, moments[t].mean()) for t in times)}
+	exact = case.exact(array(times))
+	row['weak_error'] = None if exact is None else max(norm_of(row['means'][t] - e) for t, e in zip(times, exact))
+	row['strong_error'] = strong_error(case, integrator, size, timestep, moments[times[-1]].values)
+	return row
+
+def strong_error(case, integrator, size, timestep, values):
+	if integrator is integrate_exactly or isinstance(integrator, adaptive_integrator):
+		return None
+	exact = case.exact_values(size, timestep)
+	return None if exact is None else float(abs(values - exact).mean())
+
+def norm_of(x):
+	return float(abs(array(x)).max())
+
+
+def run_benchmarks(cases, integrators, timesteps, sizes):
+	"Run every case with every integrator, timestep and size, and answer the rows of results"
+	rows = []
+	for case in cases:
+		for name, make in integrators:
+			for size in sizes:
+				runs = [run_benchmark(case, name, make(h), h, size) for h in sorted(timesteps)]
+				runs = [row for row in runs if row is not None]
+				if runs and runs[0]['weak_error'] is None:
+					for row in runs[1:]:
+						row['weak_error'] = max(norm_of(row['means'][t] - runs[0]['means'][t]) for t in runs[0]['means'])
+				rows.extend(runs)
+	for row in rows:
+		del row['means']
+	return rows
+
+
+def write_results(rows, path):
+	"Write rows, with a description of the machine, as JSON"
+	description = {'python': platform.python_version(), 'numpy': numpy.__version__, 'machine': platform.platform(), 'date': wall_clock()}
+	with open(path, 'w') as stream:
+		json.dump({'description': description, 'rows': rows}, stream, indent = 1)
+
+def read_results(path):
+	with open(path) as stream:
+		return json.load(stream)['rows']
+
+def regressions(baseline, rows, slower = 1.2, worse = 1.5):
+	"Answer the rows that took more than slower times as long, or evaluated more derivatives, or were worse times less accurate, than the same run in baseline"
+	key = lambda row: (row['case'], row['integrator'], row['timestep'], row['size'])
+	old = dict((key(row), row) for row in baseline)
+	result = []
+	for row in rows:
+		before = old.get(key(row))
+		if before is None:
+			continue
+		if row['seconds'] > slower*before['seconds'] or row['derivatives'] > before['derivatives'] \
+				or any(row[e] is not None and before[e] is not None and row[e] > worse*before[e] for e in ('weak_error', 'strong_error')):
+			result.append(row)
+	return result
+
+def print_rows(rows):
+	columns = ['case', 'integrator', 'timestep', 'size', 'seconds', 'derivatives', 'weak_error', 'strong_error']
+	print '\t'.join(columns)
+	for row in rows:
+		print '\t'.join('%.3g' % row[c] if isinstance(row[c], float) else str(row[c]) for c in columns)
+
+
+if __name__ == '__main__':
+	rows = run_benchmarks([kubo_case(), fermi_case()], standard_integrators(), [0.1, 0.05, 0.02, 0.01], [100, 1000, 10000])
+	write_results(rows, 'benchmark.json')
+	print_rows(rows)
@@ -0,0 +1,76 @@
+from namespace import *
+from benchmark import *
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+
+
+class TestBenchmark(TestCase):
+
+	def setUp(self):
+		self.rows = run_benchmarks([kubo_case(duration = 1)], standard_integrators()[:1] + standard_integrators()[-1:], [0.1, 0.05], [50])
+
+	def testRows(self):
+		self.assertEqual([(row['integrator'], row['timestep']) for row in self.rows], [('semi_implicit', 0.05), ('semi_implicit', 0.1), ('exact', 0.05), ('exact', 0.1)])
+		for row in self.rows:
+			self.assertTrue(row['seconds'] >= 0)
+			self.assertTrue(row['weak_error'] >= 0)
+		
+	def testSamePaths(self):
+		"The exact solution follows the Wiener paths of the semi-implicit integrator, so their weak errors are nearly the same"
+		for semi_implicit, exact in zip(self.rows[:2], self.rows[2:]):
+			self.assertTrue(abs(semi_implicit['weak_error'] - exact['weak_error']) < 0.02)
+
+	def testCounts(self):
+		"The semi-implicit integrator evaluates derivatives 4 times at the midpoint and once for the step, and the exact one never does"
+		counts = [row['derivatives'] for row in self.rows]
+		self.assertEqual(counts[0], 5*20)
+		self.assertEqual(counts[1], 5*10)
+		self.assertEqual(counts[2:], [0, 0])
+
+	def testStrong(self):
+		"Strong errors are measured against the exact solution on the same path, which the exact integrator does not follow"
+		self.assertTrue(self.rows[0]['strong_error'] > 0)
+		self.assertEqual([row['strong_error'] for row in self.rows[2:]], [None, None])
+		exact = kubo_case(duration = 1).exact_values(50, 0.05)
+		self.assertTrue(allclose(abs(exact), 1.5))
+
+	def testConvergence(self):
+		"The strong error shrinks in proportion to the timestep"
+		rows = run_benchmarks([kubo_case(duration = 1)], standard_integrators()[:1], [0.04, 0.02, 0.01], [200])
+		errors = [row['strong_error'] for row in rows]
+		self.assertEqual([row['timestep'] for row in rows], [0.01, 0.02, 0.04])
+		self.assertTrue(errors[0] < errors[1]/1.5 < errors[2]/2.25)
+
+	def testAdaptive(self):
+		"The adaptive integrator is run with a bridgeNoise, and has no strong error"
+		rows = run_benchmarks([kubo_case(duration = 1)], [standard_integrators()[3]], [0.1], [20])
+		self.assertEqual(rows[0]['integrator'], 'adaptive')
+		self.assertTrue(rows[0]['derivatives'] > 0)
+		self.assertTrue(rows[0]['weak_error'] < 0.5)
+		self.assertEqual(rows[0]['strong_error'], None)
+
+	def testFermi(self):
+		"The Fermi-Hubbard case runs, and is compared with its smallest timestep"
+		rows = run_benchmarks([fermi_case(duration = 0.5)], standard_integrators()[:1], [0.1, 0.05], [10])
+		self.assertEqual([row['case'] for row in rows], ['fermi_hubbard_2x2']*2)
+		self.assertEqual(rows[0]['weak_error'], None)
+		self.assertTrue(rows[1]['weak_error'] >= 0)
+		self.assertEqual([row['derivatives'] for row in rows], [5*10, 5*5])
+
+	def testRegressions(self):
+		directory = mkdtemp()
+		try:
+			path = os.path.join(directory, 'baseline.json')
+			write_results(self.rows, path)
+			baseline = read_results(path)
+		finally:
+			rmtree(directory)
+		self.assertEqual(regressions(baseline, self.rows), [])
+		slower = [dict(row) for row in self.rows]
+		slower[1]['seconds'] = 2*slower[1]['seconds'] + 1
+		self.assertEqual(regressions(baseline, slower), [slower[1]])
+
+
+if __name__ == '__main__':
+	run_tests()
@@ -1,6 +1,9 @@
 """Data types and integration procedures for physical systems."""
 
 from namespace import *
+from philox import gaussians, split_key
+from numpy import einsum, cumsum, log, full, inf, floor, sign, errstate, iscomplexobj
+from numpy.linalg import eigh, norm
 
 class ensemble(object):
 	"""I store a weighted ensemble of states of a physical system, and context such as the time and noise processes corresponding to my elements.  I compute derivatives and moments of the states."""
@@ -16,6 +19,9 @@ class ensemble(object):
 		
 	def __getattr__(self, name):
 		# Python's __getattr__ is the same as Smalltalk's notUnderstood:
+		# Special names, and everything before unpickling sets system, are my own business, so that copy and pickle work.
+		if name.startswith('__') or 'system' not in self.__dict__:
+			raise AttributeError(name)
 		return getattr(self.system, name)
 		
 	def derivative(self, noise):
@@ -28,19 +34,60 @@ class ensemble(object):
 		If an ensemble state is given, the derivatives are evaluated in that state instead of me.  This is useful for implicit integration.  The noise is always taken from me."""
 
 		if state is None: state = self
-		# FIXME Python's copy breaks when you override getattr, and prints warnings.  Wouldn't happen in Smalltalk.
-		final = copy(self)
-		final.time += step
-		xi = self.noise(self.time, step)
-		final.representations = self.representations + step * state.derivative(xi)
-		return final
+		return self.advance_into(step, state, self.spare())
+		
+	def advance_into(self, step, state, out):
+		"""Store my elements, advanced by step, in the ensemble out, and answer out.
+		
+		The derivatives are evaluated in state, as for advanced.  Out must not be me or state.  Integrators keep a few spare() ensembles, and reuse them every step instead of allocating new ones."""
+		
+		xi = None if self.noise is None else self.noise(self.time, step)
+		out.time = self.time + step
+		self.scale_add(step, state.derivative(xi), out)
+		return out
+		
+	def scale_add(self, scalar, values, out):
+		"Store my representations plus scalar times values in out"
+		result = out.representations
+		if result is None or result.shape != self.representations.shape or result.dtype != result_type(self.representations, values):
+			result = out.representations = empty_array(self.representations.shape, result_type(self.representations, values))
+		multiply(values, scalar, result)
+		result += self.representations
+		
+	def distance(self, other):
+		"The largest difference between my representations and those of other"
+		return abs(self.representations - other.representations).max()
+		
+	def spare(self):
+		"An ensemble like me, with representations of its own, for advance_into to store results in"
+		result = copy(self)
+		result.representations = empty_like(self.representations)
+		return result
+		
+	def part(self, start, stop):
+		"An ensemble of my elements start:stop, with the corresponding part of my noise."
+		result = copy(self)
+		result.size = stop - start
+		result.representations = self.representations[start:stop].copy()
+		if self.noise is not None:
+			result.noise = self.noise.part(start, stop)
+		return result
 
 			
 class VCMEnsemble(ensemble):
 
-	"""I store a superposition of weighted coherent states, for variational propagation.  Systems that will be simulated in this manner need to define methods ev_H and ev_a, that compute the matrices <H_ij>/rho_ij and <\dot a_ij>/rho_ij.
+	"""I store a superposition of weighted coherent states, for variational propagation.  Systems that will be simulated in this manner need to define methods ev_H(alphas) and ev_a(alphas), that compute the matrices <H_ij>/rho_ij and <\dot a_ij>/rho_ij.  The second has a third index for the mode.
 
-	The representation for ensemble size N and M modes is an Nx(M+1) ndarray."""
+	The representation for ensemble size N and M modes is an Nx(M+1) ndarray.  Row i holds phi_i and alpha_i, for the unnormalised coherent state |psi_i> = exp(phi_i + alpha_i.a^+)|0>.
+	
+	The matrices are computed by a vcmKernel, in workspaces that are shared with the spare ensembles integrators make from me.  They are overwritten by the next computation, so copy them if they are to be kept.  The propagation is deterministic, so my noise can be None.
+
+Example:
+from dynamics import *
+from integration import *
+state = VCMEnsemble(QuarticOscillator(), 3)
+state.representations = array([[0, 0.5], [0, 0.5j], [0, -0.5]], dtype = complex)
+semi_implicit_integrator(0.001)(state, 0.1, record(0.05, []))"""
 
 	def phis(self):
 		return self.representations[:,0]
@@ -48,31 +95,145 @@ class VCMEnsemble(ensemble):
 	def alphas(self):
 		return self.representations[:,1:]
 		
+	def kernel(self):
+		if self.__dict__.get('workspace') is None:
+			self.workspace = vcmKernel()
+		return self.workspace
+		
+	def spare(self):
+		self.kernel()
+		return ensemble.spare(self)
+		
 	def V(self):
-		edge = self.representations.copy()
-		edge[:,0] = 1
-		result = outer(edge, edge.conj())	# Flattens automatically
-		# TODO rewrite when numpy gets shared subarrays right
-		n, mpp = self.representations.shape
-		r, c = result.strides
-		here_be_dragons = ndarray((n,n,mpp-1), dtype=result.dtype, buffer=result, offset=r+c, strides=(mpp*r, mpp*c, r+c))
-		here_be_dragons += 1
-		return result
+		"The metric <d_ia psi_i|d_jb psi_j>, as an N(M+1)xN(M+1) matrix"
+		return self.kernel().overlaps(self).metric(self).matrix()
 
 	def H(self):
-		edge = self.representations.copy()
-		edge[:,0] = 1
-		Hij = self.system.ev_H(self.alphas())*exp(self.logrho())
-		result = empty_like(self.representations)
-		result = (Hij[:,:,newaxis]*edge[newaxis,:,:]).sum(1)
-		return result
+		"The sums over j of <psi_i|H|psi_j> e_ja, as an Nx(M+1) matrix"
+		return self.kernel().overlaps(self).hamiltonian(self).H
+		
+	def R(self):
+		"The projections <d_ia psi_i|H|psi>, as an Nx(M+1) matrix"
+		return self.kernel().overlaps(self).hamiltonian(self).projection(self).R
 		
+	def derivative(self, noise):
+		"The derivatives of phi and alpha, from the variational equations V dx/dt = -i R"
+		return -1j*self.kernel().evaluate(self).solve(self.kernel().R)
 		
 	def logrho(self):
-		n = self.phis().size
-		phii = self.phis().conj().reshape((n,1))
-		phij = self.phis().reshape((1,n))
-		return phii + phij + tensordot(self.alphas(), self.alphas().conj(), ((0),(0)))
+		"The logarithms of the overlaps rho_ij = <psi_i|psi_j>"
+		return self.kernel().overlaps(self).logrho
+		
+		
+class vcmKernel(object):
+
+	"""I compute the overlaps rho, the metric V and the projected Hamiltonian H of a VCMEnsemble, and solve the variational equations.  My workspaces are allocated when the shape of the ensemble changes, and reused otherwise.
+	
+	The overlap matrix of the amplitudes, conj(alpha_i).alpha_j, is computed once by overlaps, and shared by the metric and the Hamiltonian.  With e_i = (1, alpha_i),
+		rho_ij = exp(conj(phi_i) + phi_j + conj(alpha_i).alpha_j)
+		V[i,a,j,b] = rho_ij (e_ja conj(e_ib) + delta_ab [a > 0])
+		H[i,a] = sum_j rho_ij <H>_ij e_ja
+		R[i,a] = H[i,a] + i [a > 0] sum_j rho_ij <\dot a_a>_ij
+	
+	V is solved through its eigendecomposition, with eigenvalues smaller than rcond times the largest one regularised.  The semi-implicit integrator evaluates several ensembles at the same time, which converge to the midpoint of the step, so their V differ little.  The decomposition is kept for ensembles at the time it was made, and their solutions are found by iterative refinement, with up to refinements corrections.  If that does not converge to tolerance, V is decomposed afresh.  The number of decompositions is kept in factorizations."""
+	
+	def __init__(self, rcond = 1e-10, refinements = 4, tolerance = 1e-8):
+		self.shape = None
+		self.rcond = rcond
+		self.refinements = refinements
+		self.tolerance = tolerance
+		self.basis = None
+		self.time = self.factored_time = None
+		self.factorizations = 0
+		
+	def prepare(self, representations):
+		if representations.shape == self.shape:
+			return
+		self.shape = n, m = representations.shape
+		kind = result_type(representations, complex)
+		self.logrho, self.rho, self.weighted = [empty_array((n, n), dtype = kind) for i in range(3)]
+		self.edge, self.H, self.R, self.solution = [empty_array((n, m), dtype = kind) for i in range(4)]
+		self.V = empty_array((n, m, n, m), dtype = kind)
+		self.modes = arange(1, m)
+		self.basis = None
+		
+	def overlaps(self, state):
+		"Compute logrho and rho, and answer myself"
+		self.prepare(state.representations)
+		self.time = state.time
+		alphas, phis = state.alphas(), state.phis()
+		matmul(alphas.conj(), alphas.T, self.logrho)
+		self.logrho += phis.conj()[:,newaxis]
+		self.logrho += phis[newaxis,:]
+		exp(self.logrho, self.rho)
+		self.edge[:] = state.representations
+		self.edge[:,0] = 1
+		return self
+		
+	def metric(self, state):
+		"Compute V, after overlaps, and answer myself"
+		multiply(self.edge.T[newaxis,:,:,newaxis], self.edge.conj()[:,newaxis,newaxis,:], self.V)
+		self.V[:, self.modes, :, self.modes] += 1
+		self.V *= self.rho[:,newaxis,:,newaxis]
+		return self
+		
+	def hamiltonian(self, state):
+		"Compute H, after overlaps, and answer myself"
+		multiply(state.system.ev_H(state.alphas()), self.rho, self.weighted)
+		matmul(self.weighted, self.edge, self.H)
+		return self
+		
+	def projection(self, state):
+		"Compute R, after hamiltonian, and answer myself"
+		self.R[:] = self.H
+		self.R[:,1:] += 1j*einsum('ij,ija->ia', self.rho, state.system.ev_a(state.alphas()))
+		return self
+		
+	def evaluate(self, state):
+		"Compute rho, V, H and R together"
+		return self.overlaps(state).metric(state).hamiltonian(state).projection(state)
+		
+	def factorize(self):
+		"Decompose the current V, and regularise the reciprocals of its eigenvalues"
+		eigenvalues, self.basis = eigh(self.matrix())
+		cutoff = self.rcond*abs(eigenvalues).max()
+		self.reciprocals = eigenvalues/(eigenvalues**2 + cutoff**2)
+		self.factored_time = self.time
+		self.factorizations += 1
+		
+	def inverse(self, b):
+		"Apply the regularised inverse of the decomposed V to the vector b"
+		return matmul(self.basis, self.reciprocals*matmul(self.basis.conj().T, b))
+		
+	def solve(self, rhs):
+		"Solve V x = rhs, for the V computed last, and answer x, which is stored in my workspace"
+		b = rhs.reshape(-1)
+		x = self.solution.reshape(-1)
+		if self.basis is None or self.time != self.factored_time or not self.refine(b, x):
+			self.factorize()
+			x[:] = self.inverse(b)
+		return self.solution
+		
+	def refine(self, b, x):
+		"Improve x towards the solution of V x = b, starting from the old decomposition.  Answer whether that converged."
+		x[:] = self.inverse(b)
+		V = self.matrix()
+		last = None
+		for k in range(self.refinements):
+			correction = self.inverse(b - matmul(V, x))
+			x += correction
+			size = norm(correction)
+			if size <= self.tolerance*norm(x):
+				return True
+			if last is not None and size > last:
+				return False
+			last = size
+		return False
+		
+	def matrix(self):
+		"V, as a square matrix indexed by ensemble element and parameter"
+		n, m = self.shape
+		return self.V.reshape((n*m, n*m))
 
 
 class QuarticOscillator(object):
@@ -85,14 +246,40 @@ state.representations = zeros((5,2))
 	"""
 	
 	def ev_H(self, alphas):
-		return outer(alphas.conj()**2, alphas**2)
+		return matmul(alphas.conj()**2, (alphas**2).T)
 		
-	def ev_a(self):
-		pass
+	def ev_a(self, alphas):
+		"The Heisenberg derivative of a is -i[a, a^+ a^+ a a] = -2i a^+ a a"
+		return -2j*alphas.conj()[:,newaxis,:]*(alphas**2)[newaxis,:,:]
+
+
+def log_magnitudes(weights):
+	"The logs of the magnitudes of weights, which are -inf for zero weights, and the signs of weights, or None if none are negative.  Weights must be real."
+	weights = array(weights, ndmin = 1)
+	if iscomplexobj(weights):
+		raise TypeError("Weights must be real")
+	weights = weights.astype(float)
+	with errstate(divide = 'ignore'):
+		logs = log(abs(weights))
+	return logs, (None if (weights >= 0).all() else sign(weights))
 
 
 class weightedEnsemble(ensemble):
-	"""I store an ensemble with weights"""
+	"""I store an ensemble with weights.  The magnitudes of the weights are kept as their logarithms, log_weights, so that they can grow or shrink without bound over a long run, and their signs are kept in signs, which is None when no weight is negative.  The weights property converts to and from them."""
+	
+	log_weights = None
+	signs = None
+	
+	@property
+	def weights(self):
+		"A new array of my weights.  Changing it leaves me alone: assign to weights, or change log_weights."
+		if self.log_weights is None:
+			return None
+		return exp(self.log_weights) if self.signs is None else exp(self.log_weights)*self.signs
+		
+	@weights.setter
+	def weights(self, weights):
+		self.log_weights, self.signs = (None, None) if weights is None else log_magnitudes(weights)
 					
 	def weight_log_derivative(self, noise):
 		"Subclasses may override this."
@@ -104,17 +291,99 @@ class weightedEnsemble(ensemble):
 		If an ensemble state is given, the derivatives are evaluated in that state instead of me.  This is useful for implicit integration."""
 
 		if state is None: state = self
-		final = copy(self)
-		final.time += step
+		return self.advance_into(step, state, self.spare())
+		
+	def advance_into(self, step, state, out):
 		xi = self.noise(self.time, step)
-		final.representations, final.weights = self.scale_adapt_add(step, state.derivative(xi), state.weight_log_derivative(xi))
-		return final
+		out.time = self.time + step
+		self.scale_adapt_add(step, state.derivative(xi), state.weight_log_derivative(xi), out)
+		return out
 		
-	def scale_adapt_add(self, scalar, absolute_values, relative_weights):
-		if self.weights is None:
-			return self.representations + scalar*absolute_values, None
+	def spare(self):
+		result = ensemble.spare(self)
+		if self.log_weights is not None:
+			result.log_weights = empty_like(self.log_weights)
+		return result
+		
+	def part(self, start, stop):
+		result = ensemble.part(self, start, stop)
+		if self.log_weights is not None:
+			result.log_weights = self.log_weights[start:stop].copy()
+		if self.signs is not None:
+			result.signs = self.signs[start:stop].copy()
+		return result
+		
+	def scale_adapt_add(self, scalar, absolute_values, relative_weights, out):
+		"Store my representations plus scalar times absolute_values, and my log weights plus scalar times relative_weights, the derivatives of the log weights, in out.  The signs of the weights do not change."
+		self.scale_add(scalar, absolute_values, out)
+		out.signs = self.signs
+		if self.log_weights is None:
+			out.log_weights = None
 		else:
-			return self.representations + scalar*absolute_values, self.weights*(scalar*relative_weights+1)
+			if out.log_weights is None or out.log_weights.shape != self.log_weights.shape:
+				out.log_weights = empty_like(self.log_weights)
+			multiply(relative_weights, scalar, out.log_weights)
+			out.log_weights += self.log_weights
+			
+	def effective_size(self):
+		"(sum |w|)^2/(sum |w|^2), the number of equally weighted elements that would give the same statistical error"
+		weights = exp(self.log_weights - self.log_weights.max())
+		return weights.sum()**2/(weights**2).sum()
+			
+	def branch(self, indices, log_weights):
+		"Replace my elements by copies of those at indices, with log_weights, in place.  The signs of the weights follow the elements.  Subclasses with other arrays indexed by element extend this."
+		self.representations[:] = self.representations[indices]
+		self.log_weights[:] = log_weights
+		if self.signs is not None:
+			self.signs = self.signs[indices]		# A new array, because spares share the signs
+	
+
+class resampling(object):
+
+	"""I rebalance the weights of a weightedEnsemble, when its effective size falls below threshold times its size, by duplicating elements with large weights and dropping those with small ones.
+
+	Element i is copied a number of times whose expectation is proportional to |w_i|, and every copy gets the weight (sum |w|/size) w_i/|w_i|, so the expectations of weighted moments are unchanged.  Subclasses choose the copies.  An integrator with a resampler calls it after every step.  The number of times I have resampled is kept in resamplings."""
+
+	def __init__(self, threshold = 0.5, seed = None):
+		self.threshold = threshold
+		self.generator = RandomState(seed)
+		self.resamplings = 0
+
+	def __call__(self, state):
+		"Resample state in place, if it needs it, and answer whether it did"
+		if getattr(state, 'log_weights', None) is None or state.effective_size() >= self.threshold*state.size:
+			return False
+		scale = state.log_weights.max()
+		weights = exp(state.log_weights - scale)
+		total = weights.sum()
+		state.branch(self.choose(weights/total, state.size), scale + log(total/state.size))
+		self.resamplings += 1
+		return True
+
+	def systematic(self, probabilities, count):
+		"Count indices, chosen by one uniform deviate stratified over count equal intervals"
+		points = (self.generator.uniform() + arange(count))/count
+		return cumsum(probabilities).searchsorted(points, 'right').clip(0, probabilities.size - 1)
+
+
+class systematicResampling(resampling):
+	"Copies come from a single comb of evenly spaced points over the cumulative weights"
+
+	def choose(self, probabilities, count):
+		return self.systematic(probabilities, count)
+
+
+class residualResampling(resampling):
+	"Element i is copied floor(count p_i) times, and the remaining copies are chosen systematically from the remainders"
+
+	def choose(self, probabilities, count):
+		copies = (count*probabilities).astype(int)
+		indices = arange(probabilities.size).repeat(copies)
+		remaining = count - indices.size
+		if remaining == 0:
+			return indices
+		remainders = count*probabilities - copies
+		return append(indices, self.systematic(remainders/remainders.sum(), remaining))
 	
 
 
@@ -135,8 +404,35 @@ class record(object):
 		t = self.nearest(state.time)
 		mtds = [m for m in self.results if hasattr(state, m)]
 		for method in mtds:
-			m = getattr(state, method)()
-			self.results[method][t] = self.results[method][t].combine(m) if t in self.results[method] else m
+			self.incorporate(method, t, getattr(state, method)())
+			
+	def incorporate(self, method, t, moment):
+		"Combine moment with the results for method at time t"
+		results = self.results[method]
+		# The moment can share storage with the state, which integrators reuse
+		results[t] = results[t].combine(moment) if t in results else moment.copy()
+		
+	def add_samples(self, method, times, values, weights = None):
+		"Incorporate samples of method at each of times, such as exact solutions computed for all times at once.  Values[k] is the ensemble at times[k], and weights default to one."
+		if method not in self.recorded_methods():
+			return
+		for t, sample in zip(times, values):
+			self.incorporate(method, self.nearest(t), weightings(sample, ones(sample.shape[0]) if weights is None else weights))
+			
+	def recorded_methods(self):
+		return self.results.keys()
+			
+	def empty(self):
+		"A record like me, with no results"
+		result = copy(self)
+		result.results = dict((method, {}) for method in self.results)
+		return result
+		
+	def merge(self, other):
+		"Incorporate the results of other, which was recorded with the same timestep.  The ensembles at each time are combined, in the order that I and other were added."
+		for method in self.results:
+			for t, m in other.results.get(method, {}).items():
+				self.incorporate(method, t, m)
 			
 	# FIXME: get rid of home-rolled rounding
 	def nearest(self, t):
@@ -152,35 +448,260 @@ class record(object):
 		return t if self.nearest(t) == t else self.next(t)
 
 
+class arrayRecord(record):
+
+	"""I store moments in arrays that are allocated once, indexed by sampling time, instead of combining weightings.  The sampling times run from start to start+duration, at intervals of timestep.  Like those of a record, they lie on a grid anchored at 0, so start must be a multiple of timestep.
+	
+	If a capacity is given, I keep up to that many samples of each moment at each time, with their weights, in arrays indexed by time and sample.  Otherwise I only keep running weighted sums of the values, and the total weights.  The weights at each time are kept relative to exp(scale), where the scale follows the largest weight added at that time, so weights of any size can be recorded.  Either way, adding an ensemble costs time in proportion to its size, not to the number of samples already recorded.
+	
+	My results are presented in the same form as those of a record, as views of my arrays."""
+	
+	def __init__(self, timestep, methods, duration, capacity = None, start = 0.):
+		assert abs(start/timestep - round(start/timestep)) < 1e-6, "The start of an arrayRecord must be a multiple of its timestep"
+		self.timestep = timestep
+		self.start = start
+		self.length = int(round(duration/timestep)) + 1
+		self.capacity = capacity
+		self.columns = dict((method, None) for method in methods)	# Allocated when the first moment shows its shape
+		self.counts = dict((method, zeros(self.length, dtype = int)) for method in methods)
+		
+	def index(self, t):
+		"The row for sampling time t, which must lie within my duration"
+		i = int(round((t - self.start)/self.timestep))
+		if not 0 <= i < self.length:
+			raise IndexError("Time %g is outside the record" % t)
+		return i
+		
+	def add(self, state):
+		i = self.index(state.time)
+		for method in self.columns:
+			if hasattr(state, method):
+				self.store(method, i, getattr(state, method)())
+				
+	def incorporate(self, method, t, moment):
+		self.store(method, self.index(t), moment)
+		
+	def recorded_methods(self):
+		return self.columns.keys()
+				
+	def store(self, method, i, moment):
+		"Incorporate a weightings of moment at sampling time index i"
+		if self.columns[method] is None:
+			self.allocate(method, moment)
+		values, weights, scales = self.columns[method]
+		if result_type(values, moment.values) != values.dtype:
+			# e.g. real initial conditions, followed by complex amplitudes
+			values = values.astype(result_type(values, moment.values))
+			self.columns[method] = values, weights, scales
+		n, k = self.counts[method][i], moment.values.shape[0]
+		assert self.capacity is None or n + k <= self.capacity, "More samples than the capacity of the record"
+		relative, scale = moment.relative_weights()
+		if scale > scales[i]:
+			factor = exp(scales[i] - scale)
+			if self.capacity is None:
+				values[i] *= factor
+			weights[i] *= factor
+			scales[i] = scale
+		relative = relative*exp(scale - scales[i])
+		if self.capacity is None:
+			values[i] += tensordot(relative, moment.values, 1)
+			weights[i] += relative.sum()
+		else:
+			values[i, n:n+k] = moment.values
+			weights[i, n:n+k] = relative
+		self.counts[method][i] = n + k
+		
+	def allocate(self, method, moment):
+		samples = () if self.capacity is None else (self.capacity,)
+		values = zeros((self.length,) + samples + moment.values.shape[1:], dtype = moment.values.dtype)
+		weights = zeros((self.length,) + samples)
+		self.columns[method] = values, weights, full(self.length, -inf)
+		
+	def moment(self, method, i):
+		"A weightings of the samples at time index i, or of their mean if I only keep sums"
+		values, weights, scales = self.columns[method]
+		if self.capacity is None:
+			return weightings.scaled((values[i]/weights[i])[newaxis], weights[i:i+1], scales[i])
+		else:
+			n = self.counts[method][i]
+			return weightings.scaled(values[i, :n], weights[i, :n], scales[i])
+			
+	@property
+	def results(self):
+		result = {}
+		for method in self.columns:
+			result[method] = {}
+			for i in self.counts[method].nonzero()[0]:
+				result[method][self.nearest(self.start + i*self.timestep)] = self.moment(method, i)
+		return result
+		
+	def empty(self):
+		result = copy(self)
+		result.columns = dict((method, None) for method in self.columns)
+		result.counts = dict((method, zeros(self.length, dtype = int)) for method in self.columns)
+		return result
+		
+	def merge(self, other):
+		for method in self.columns:
+			for t, moment in other.results.get(method, {}).items():
+				self.store(method, self.index(t), moment)
+
+
 class weightings(object):
 
-	"""Stores an ndarray of values, and one of weights.  The weights correspond to slices of the values along the leading dimension."""
+	"""Stores an ndarray of values, and one of weights.  The weights correspond to slices of the values along the leading dimension.
+	
+	The magnitudes of the weights are kept as their logarithms, log_weights, which can be given instead of them, and their signs as signs, which is None when no weight is negative.  Reductions are done relative to the largest magnitude, so weights too large or too small for floating point are handled."""
 	
 	# This could be made polymorphic with unweightings, if necessary for efficiency.
 	
-	def __init__(self, values, weights = None):
+	def __init__(self, values, weights = None, log_weights = None, signs = None):
 		# handle singletons
 		if not isinstance(values, ndarray):
 			values = array([values])
-		if weights is None:
-			weights = ones(values.shape[0])
-		if not isinstance(weights, ndarray):
-			weights = array([weights])
-		assert weights.shape == values.shape[0:1]
+		if log_weights is None:
+			log_weights, signs = (zeros(values.shape[0]), None) if weights is None else log_magnitudes(weights)
+		if not isinstance(log_weights, ndarray):
+			log_weights = array([log_weights])
+		assert log_weights.shape == values.shape[0:1]
+		assert signs is None or signs.shape == log_weights.shape
 		self.values = values
-		self.weights = weights
+		self.log_weights = log_weights
+		self.signs = signs
+		
+	@staticmethod
+	def scaled(values, weights, log_scale):
+		"A weightings of values, whose weights are weights times exp(log_scale)"
+		result = weightings(values, weights)
+		result.log_weights += log_scale
+		return result
+		
+	@property
+	def weights(self):
+		return exp(self.log_weights) if self.signs is None else exp(self.log_weights)*self.signs
+		
+	def relative_weights(self):
+		"My weights divided by the largest magnitude, and the log of the largest magnitude"
+		scale = self.log_weights.max()
+		if scale == -inf:
+			scale = 0.		# All the weights are zero
+		weights = exp(self.log_weights - scale)
+		return (weights if self.signs is None else weights*self.signs), scale
 		
 	def reduced(self):
-		mean, net = average(self.values, 0, self.weights, True)
-		mean = mean.reshape((1,) + mean.shape)
-		net = net.reshape((1,) + net.shape)
-		return weightings(mean, net)
+		weights, scale = self.relative_weights()
+		mean = average(self.values, 0, weights)
+		return weightings.scaled(mean[newaxis], array([weights.sum()]), scale)
+		
+	def copy(self):
+		return weightings(self.values.copy(), log_weights = self.log_weights.copy(), signs = None if self.signs is None else self.signs.copy())
 		
 	def mean(self):
-		self.reduced().values[0,::]
+		return self.reduced().values[0]
 				
 	def combine(self, other):
-		return weightings(append(self.values, other.values), append(self.weights, other.weights))
+		signs = None
+		if self.signs is not None or other.signs is not None:
+			signs = append(self.all_signs(), other.all_signs(), 0)
+		return weightings(append(self.values, other.values, 0), log_weights = append(self.log_weights, other.log_weights, 0), signs = signs)
+		
+	def all_signs(self):
+		"My signs, as an array even when no weight is negative"
+		return ones(self.log_weights.shape) if self.signs is None else self.signs
+
+
+class momentRecord(record):
+
+	"""I keep weightedMoments, instead of every sample, so that my memory doesn't grow with the size of the ensemble."""
+	
+	def incorporate(self, method, t, moment):
+		results = self.results[method]
+		results[t] = results[t].combine(moment) if t in results else weightedMoments(moment)
+
+
+class weightedMoments(object):
+
+	"""I accumulate the weighted mean and variance of samples, in memory that doesn't grow with their number, using the updates of West and of Chan et al.  Samples are incorporated from weightings with combine, and partial accumulations can be merged the same way.
+	
+	The variance is the weighted variance of the samples, and the standard error is that of the weighted mean, estimated with the effective sample size (sum w)^2/(sum w^2).
+	
+	The weights can be negative, in which case the sums are signed.  The sums are kept relative to the weight exp(log_scale), which follows the largest magnitude incorporated, so that weights of any size can be accumulated."""
+	
+	def __init__(self, sample = None):
+		self.weight = 0.			# Sum of the weights
+		self.square_weight = 0.		# Sum of the squared weights
+		self.log_scale = 0.		# The weights above, and the spread, are relative to exp(log_scale)
+		self.count = 0
+		self.average = None
+		self.spread = None			# Sum of w|x-mean|^2
+		if sample is not None:
+			self.combine(sample)
+			
+	def combine(self, other):
+		"Incorporate a weightings, or another accumulation of moments.  Answer myself."
+		if isinstance(other, weightings):
+			other = self.summary(other)
+		if other.count == 0:
+			return self
+		if self.count == 0:
+			self.weight, self.square_weight, self.log_scale, self.count = other.weight, other.square_weight, other.log_scale, other.count
+			self.average, self.spread = other.average.copy(), other.spread.copy()
+			return self
+		scale = max(self.log_scale, other.log_scale)
+		mine, theirs = exp(self.log_scale - scale), exp(other.log_scale - scale)
+		weight, other_weight = self.weight*mine, other.weight*theirs
+		delta = other.average - self.average
+		total = weight + other_weight
+		self.average = self.average + delta*(other_weight/total)
+		self.spread = self.spread*mine + other.spread*theirs + abs(delta)**2*(weight*other_weight/total)
+		self.square_weight = self.square_weight*mine**2 + other.square_weight*theirs**2
+		self.weight, self.log_scale, self.count = total, scale, self.count + other.count
+		return self
+		
+	@staticmethod
+	def summary(sample):
+		"The moments of a weightings, computed in one pass over its values"
+		result = weightedMoments()
+		weights, result.log_scale = sample.relative_weights()
+		result.weight = weights.sum()
+		result.square_weight = (weights**2).sum()
+		result.count = weights.size
+		result.average = tensordot(weights, sample.values, 1)/result.weight
+		result.spread = tensordot(weights, abs(sample.values - result.average)**2, 1)
+		return result
+		
+	def copy(self):
+		return weightedMoments().combine(self)
+		
+	def mean(self):
+		return self.average
+		
+	def variance(self):
+		return self.spread/self.weight
+		
+	def effective_size(self):
+		return self.weight**2/self.square_weight
+		
+	def standard_error(self):
+		return (self.variance()/self.effective_size())**0.5
+		
+	def log_weight(self):
+		"The log of the magnitude of the sum of the weights"
+		return log(abs(self.weight)) + self.log_scale
+		
+	def reduced(self):
+		"A weightings of my mean, weighted by my total weight"
+		return weightings.scaled(self.average[newaxis], array([self.weight]), self.log_scale)
+
+
+def grid_steps(start, duration, timestep):
+	"""The number of steps of a grid with spacing timestep that an interval covers.  An interval no longer than a step covers one.  A longer one must start on the grid, and last a whole number of steps, to within rounding, otherwise I raise a ValueError: rounding it to the grid would give the increment of a different interval."""
+	steps = duration/timestep
+	if steps <= 1 + 1e-6:
+		return 1
+	if abs(steps - round(steps)) > 1e-6 or abs(start/timestep - round(start/timestep)) > 1e-6:
+		raise ValueError("The interval of %g from %g is not a whole number of steps of %g" % (duration, start, timestep))
+	return int(round(steps))
 
 
 class noise(object):
@@ -202,6 +723,10 @@ class noise(object):
 	def derivatives(self, bounds, start, duration):
 		raise "Subclass responsibility"
 		
+	def part(self, start, stop):
+		"Noise for the elements start:stop of an ensemble, to be integrated separately from the rest."
+		raise "Subclass responsibility"
+		
 	def __call__(self, start, duration):
 		assert self.start is None or start != self.start
 		assert self.duration is None or duration != self.duration
@@ -237,21 +762,183 @@ class noise(object):
 
 class numpyNoise(noise):
 
-	"""Draws fresh normal deviates with every new interval.  Repeating the last call returns the same results, so that semi-implicit methods converge."""
+	"""Draws fresh normal deviates with every new interval.  Repeating the last call returns the same results, so that semi-implicit methods converge.
+	
+	If a seed is given, I draw from my own generator, otherwise from numpy.random."""
 	
-	def __init__(self, *args):
-		noise.__init__(self, *args)
+	def __init__(self, seed = None):
+		noise.__init__(self)
+		self.seed = seed
+		self.generator = None if seed is None else RandomState(seed)
 		self.last_bounds = None
 		self.last_start = None
 		self.last_duration = None
 	
 	def derivatives(self, bounds, start, duration):
-		if (bounds, start) == (self.parent.last_bounds, self.parent.last_start):
+		if (bounds, start) == (self.parent.last_bounds, self.parent.last_start) and self.parent.last_duration != 0.:
 			return self.parent.last_result / sqrt(duration / self.parent.last_duration)
 		dims = [(s if isinstance(s, int) else s.stop - s.start) for s in bounds]
 		if duration == 0.:
 			result = ones(dims)
 		else:
-			result = normal_deviates(0, 1/sqrt(duration), dims)
+			deviates = normal_deviates if self.parent.generator is None else self.parent.generator.normal
+			result = deviates(0, 1/sqrt(duration), dims)
 		self.parent.last_bounds, self.parent.last_start, self.parent.last_duration, self.parent.last_result = bounds, start, duration, result
 		return result
+		
+	def part(self, start, stop):
+		"Part of an ensemble gets an independent, seeded stream, derived from my seed and start"
+		return numpyNoise(self.part_seed(start))
+		
+	def part_seed(self, start):
+		seed = randint(2**31) if self.seed is None else self.seed
+		return RandomState([start, seed]).randint(2**31)
+
+
+class blockNoise(numpyNoise):
+
+	"""Draws the deviates for the next block time steps of all processes in one call, and hands out views of the buffer.  Steps are indexed on a grid with spacing timestep.
+	
+	As with counterNoise, any interval that starts within a step, and is no longer than it, sees the Wiener derivative of the whole step, so that semi-implicit methods converge to the path of whole steps.  A longer interval, which must lie on the grid as for counterNoise and span at most block steps, sees the mean of the derivatives of its steps.  The deviates for a step are kept until a request moves past the block that holds them: a refill keeps the deviates of the steps that the old and new blocks share."""
+	
+	def __init__(self, timestep, block = 64, seed = None):
+		numpyNoise.__init__(self, seed)
+		self.timestep = timestep
+		self.block = block
+		self.buffer = None
+		self.buffer_bounds = None
+		self.first_step = None
+		
+	def __getitem__(self, indices):
+		# Shortcut the copy and eval, for the usual request noise(start, duration)[bounds]
+		if self.bounds is None and self.start is not None and self.duration is not None:
+			if isinstance(indices, slice):
+				indices = (indices,)
+			if all([isinstance(i, slice) and i.start is not None and i.stop is not None for i in indices]):
+				return self.derivatives(indices, self.start, self.duration)
+		return numpyNoise.__getitem__(self, indices)
+		
+	def derivatives(self, bounds, start, duration):
+		if duration == 0.:
+			return ones([s.stop - s.start for s in bounds])
+		count = grid_steps(start, duration, self.timestep)
+		assert count <= self.block, "An interval longer than a block of noise"
+		step = int(floor(start/self.timestep + 1e-6))
+		parent = self.parent
+		if bounds != parent.buffer_bounds or not parent.first_step <= step <= step + count <= parent.first_step + parent.block:
+			parent.refill(bounds, step)
+		rows = parent.buffer[step - parent.first_step : step - parent.first_step + count]
+		return rows[0] if count == 1 else rows.mean(0)
+		
+	def refill(self, bounds, step):
+		"Draw the deviates for block steps, starting at step.  Steps that my last block for the same bounds held keep their deviates."
+		dims = tuple([s.stop - s.start for s in bounds])
+		deviates = normal_deviates if self.generator is None else self.generator.normal
+		buffer = deviates(0, 1/sqrt(self.timestep), (self.block,) + dims)
+		if bounds == self.buffer_bounds:
+			first, last = max(step, self.first_step), min(step, self.first_step) + self.block
+			if first < last:
+				buffer[first - step : last - step] = self.buffer[first - self.first_step : last - self.first_step]
+		self.buffer, self.buffer_bounds, self.first_step = buffer, bounds, step
+		
+	def part(self, start, stop):
+		return blockNoise(self.timestep, self.block, self.part_seed(start))
+
+
+class bridgeNoise(noise):
+
+	"""Samples Wiener paths lazily, at whatever times are asked for.  A time between two known points of a path is filled in with a Brownian bridge, so refining an interval keeps the path the same.  The derivative over an interval is the increment of the path, divided by the duration.
+	
+	Known points are kept until forget is called."""
+	
+	def __init__(self, seed = None):
+		noise.__init__(self)
+		self.seed = seed
+		self.generator = RandomState(seed)
+		self.paths = {}		# Map bounds to a sorted list of times, and a list of path values at those times
+		
+	def derivatives(self, bounds, start, duration):
+		if duration == 0.:
+			return ones([s.stop - s.start for s in bounds])
+		return (self.parent.path(bounds, start + duration) - self.parent.path(bounds, start)) / duration
+		
+	def path(self, bounds, t):
+		"The value of the Wiener processes in bounds at time t, relative to the first time asked for"
+		key = tuple([(s.start, s.stop) for s in bounds])
+		if key not in self.paths:
+			self.paths[key] = [t], [zeros([s.stop - s.start for s in bounds])]
+			return self.paths[key][1][0]
+		times, values = self.paths[key]
+		i = bisect_left(times, t)
+		for j in i-1, i:
+			# Times computed by different sums of steps can differ by rounding
+			if 0 <= j < len(times) and abs(times[j] - t) <= 1e-12*max(1., abs(t)):
+				return values[j]
+		z = self.generator.normal(size = values[0].shape)
+		if i == len(times):
+			value = values[-1] + sqrt(t - times[-1])*z
+		elif i == 0:
+			value = values[0] + sqrt(times[0] - t)*z
+		else:
+			a, b = times[i-1], times[i]
+			value = values[i-1] + (t-a)/(b-a)*(values[i] - values[i-1]) + sqrt((t-a)*(b-t)/(b-a))*z
+		times.insert(i, t)
+		values.insert(i, value)
+		return value
+		
+	def forget(self, before):
+		"Discard the points of my paths before the time before, apart from the latest of them"
+		for times, values in self.parent.paths.values():
+			i = max(bisect_right(times, before) - 1, 0)
+			del times[:i], values[:i]
+			
+	def part(self, start, stop):
+		seed = randint(2**31) if self.seed is None else self.seed
+		return bridgeNoise(RandomState([start, seed]).randint(2**31))
+
+
+class counterNoise(noise):
+
+	"""Derives Wiener increments deterministically from a seed, the process indices and the index of the time step, with the Philox counter-based generator.  Any slice of the noise, at any time, can be regenerated on demand without storing history, so semi-implicit iterations, parallel workers and restarted runs all see the same noise.
+	
+	Time steps are indexed on a grid with spacing timestep.  An interval that starts within a step, and is no longer than it, sees the Wiener derivative of the whole step, its increment divided by timestep, so the half steps of a semi-implicit method follow the same path as whole steps.  A longer interval sees the sum of the increments of its steps divided by its duration, as exact solutions need.  It must lie on the grid, see grid_steps.  Bounds can have one or two dimensions."""
+	
+	def __init__(self, seed, timestep, offset = 0):
+		noise.__init__(self)
+		self.seed = seed
+		self.timestep = timestep
+		self.offset = offset		# Added to the first process index, for parts of an ensemble
+		
+	def step_index(self, start):
+		"The step whose interval holds start, allowing for rounding in the time"
+		return int(floor(start/self.timestep + 1e-6))
+		
+	def derivatives(self, bounds, start, duration):
+		if duration == 0.:
+			return ones([s.stop - s.start for s in bounds])
+		first = self.step_index(start)
+		count = grid_steps(start, duration, self.timestep)
+		if count == 1:
+			return self.deviates(bounds, [first])[0] / sqrt(self.timestep)
+		return self.deviates(bounds, arange(first, first + count)).sum(0) * (sqrt(self.timestep)/duration)
+		
+	def deviates(self, bounds, steps):
+		"Unit normal deviates for processes in bounds, at each of the time step indices steps.  Answer an array indexed by step, then by process."
+		assert 1 <= len(bounds) <= 2
+		first = slice(bounds[0].start + self.offset, bounds[0].stop + self.offset)
+		columns = arange(bounds[1].start, bounds[1].stop) if len(bounds) == 2 else arange(1)
+		base = first.start//4
+		blocks = arange(base, (first.stop+3)//4)		# Each counter gives deviates for 4 consecutive rows
+		steps = array(steps, dtype = int64)
+		counters = empty_array((steps.size, blocks.size, columns.size, 4), dtype = int64)
+		counters[...,0] = blocks[newaxis,:,newaxis]
+		counters[...,1] = columns[newaxis,newaxis,:]
+		counters[...,2] = (steps & 0xffffffff)[:,newaxis,newaxis]
+		counters[...,3] = ((steps >> 32) & 0xffffffff)[:,newaxis,newaxis]
+		result = gaussians(counters, split_key(self.seed)).transpose((0,1,3,2)).reshape((steps.size, 4*blocks.size, columns.size))
+		result = result[:, first.start - 4*base : first.stop - 4*base, :]
+		return result if len(bounds) == 2 else result[...,0]
+		
+	def part(self, start, stop):
+		"Part of an ensemble sees the same noise it would have seen in the whole ensemble"
+		return counterNoise(self.seed, self.timestep, self.offset + start)
@@ -0,0 +1,128 @@
+from namespace import *
+from dynamics import *
+from fermi_hubbard import *
+from integration import *
+from parallel import sweep
+from weightings import Weighting
+from numpy.random import normal
+from numpy import isfinite
+
+
+class TestOperators(TestCase):
+
+	def setUp(self):
+		self.system = GreensFermiHubbard(sites = [2,3], repulsion = 0.5, hopping = 1, chemical_potential = 0)
+		
+	def testLinks(self):
+		"The precomputed links are the adjacencies of the grid, flattened"
+		self.assertEqual(self.system.links.shape, (6, 6))
+		self.assertEqual(self.system.links.sum(), len(set(adjacencies([2,3]))))
+		self.assertTrue((self.system.links == self.system.links.T).all())
+		self.assertTrue((self.system.links[self.system.diagonal] == 0).all())
+		
+	def testZeroHopping(self):
+		"Without hopping, diagonal greens functions stay diagonal"
+		system = GreensFermiHubbard(self.system, hopping = 0)
+		state = system.initial(0.3)
+		noise = normal(size = len(system.noise_required(state)))
+		deriv = system.derivative(0, state, noise).mean.reshape((2, 6, 6))
+		self.assertTrue(allclose(deriv[:, system.links == 1], 0))
+		
+	def testStencil(self):
+		"The neighbour stencil agrees with dense products by the matrices delta"
+		greens = normal(size = (3, 2, 6, 6))
+		noise = normal(size = (3, 2, 6))
+		f = array([copysign(1, -self.system.repulsion), 1])
+		potential = self.system.chemical_potential - self.system.repulsion_terms(greens)[...,:,newaxis,:] \
+			- sqrt(2*abs(self.system.repulsion)) * f[:,newaxis,newaxis] * noise[...,newaxis,:,:]
+		delta = empty_array(potential.shape + (6,))
+		delta[:] = self.system.hopping*self.system.links
+		delta[..., self.system.diagonal[0], self.system.diagonal[1]] = potential
+		holes = unit(6) - greens
+		dense = 0.5*(matmul(matmul(holes, delta[...,0,:,:]), greens) + matmul(matmul(greens, delta[...,1,:,:]), holes))
+		self.assertTrue(allclose(self.system.greens_dot(greens, noise), dense))
+		self.assertTrue(allclose(self.system.hop(greens), matmul(self.system.links, greens)))
+		
+	def testPeriodic(self):
+		"A periodic ring links the ends"
+		ring = GreensFermiHubbard(sites = [5], repulsion = 0.5, hopping = 1, chemical_potential = 0, periodic = True)
+		self.assertEqual(ring.links[0, 4], 1)
+		self.assertTrue((ring.links.sum(0) == 2).all())
+		self.assertEqual(GreensFermiHubbard(sites = [5], repulsion = 0.5, hopping = 1, chemical_potential = 0).links[0, 4], 0)
+		
+	def testShared(self):
+		"Variants of a model share its operators, unless they change the grid"
+		variant = GreensFermiHubbard(self.system, repulsion = 2)
+		self.assertTrue(variant.links is self.system.links)
+		self.assertTrue(variant.neighbours is self.system.neighbours)
+		self.assertEqual((variant.repulsion, self.system.repulsion), (2, 0.5))
+		self.assertEqual(GreensFermiHubbard(self.system, sites = [3]).links.shape, (3, 3))
+		
+		
+class TestEnsemble(TestCase):
+
+	def setUp(self):
+		self.system = GreensFermiHubbard(sites = [2,3], repulsion = -1.5, hopping = 0.4, chemical_potential = 0.2)
+		self.greens = normal(size = (5, 2) + 2*self.system.sites)
+		self.weights = normal(1, 0.1, 5)
+		self.noise = normal(size = (5, 2*self.system.site_count))
+		
+	def testBatch(self):
+		"Differentiating an ensemble agrees with differentiating its elements one at a time"
+		batch = self.system.derivative(0, Weighting(self.greens, self.weights), self.noise)
+		for k in range(5):
+			single = self.system.derivative(0, Weighting(self.greens[k], self.weights[k]), self.noise[k])
+			self.assertTrue(allclose(batch.mean[k], single.mean))
+			self.assertTrue(allclose(batch.weight[k], single.weight))
+			
+	def testInitial(self):
+		state = self.system.initial(0.3, 4)
+		self.assertEqual(state.mean.shape, (4,) + self.system.initial(0.3).mean.shape)
+		self.assertTrue((state.weight == 1).all())
+
+		
+class TestGreensEnsemble(TestCase):
+
+	def setUp(self):
+		self.system = GreensFermiHubbard(sites = [2,2], repulsion = 0.5, hopping = 0.3, chemical_potential = 0.1)
+		self.state = FermiHubbardGreens(self.system, 20)
+		self.state.set_filling(0.5)
+		self.state.noise = counterNoise(4, 0.01)
+		
+	def testDerivative(self):
+		"The ensemble derivative is the system derivative of each element"
+		xi = self.state.noise[0:20, 0:8](0., 0.01)
+		batch = self.state.derivative(xi)
+		for k in 0, 7:
+			single = self.system.derivative(0, Weighting(self.state.representations[k]), xi[k, 0:8])
+			self.assertTrue(allclose(batch[k], single.mean))
+		
+	def testIntegrate(self):
+		results = record(0.5, ["greens_moment"])
+		semi_implicit_integrator(0.01)(self.state, 1, results)
+		self.assertEqual(sorted(results.results["greens_moment"].keys()), [0., 0.5, 1.])
+		final = results.results["greens_moment"][1.]
+		self.assertEqual(final.values.shape, (20, 2, 2, 2, 2, 2))
+		self.assertTrue(isfinite(final.values).all() and isfinite(final.log_weights).all())
+
+	def testSweep(self):
+		"A sweep varies the parameters of a model, whose systems share its operators"
+		systems = []
+		def prepare(system):
+			systems.append(system)
+			state = FermiHubbardGreens(system, 20)
+			state.set_filling(0.5)
+			return state
+		points = sweep(self.system, {'repulsion': [0.5, 1.]}, prepare, self.state.noise, semi_implicit_integrator(0.01), 0.5, record(0.5, ["greens_moment"]), 1)
+		self.assertEqual([point for point, result in points], [{'repulsion': 0.5}, {'repulsion': 1.}])
+		self.assertEqual([(s.__class__, s.repulsion, s.hopping) for s in systems], [(GreensFermiHubbard, 0.5, 0.3), (GreensFermiHubbard, 1., 0.3)])
+		self.assertTrue(all(s.links is self.system.links for s in systems))
+		greens = [result.results["greens_moment"][0.5].values for point, result in points]
+		self.assertTrue((greens[0] != greens[1]).any())
+		results = record(0.5, ["greens_moment"])
+		semi_implicit_integrator(0.01)(self.state, 0.5, results)
+		self.assertTrue(allclose(results.results["greens_moment"][0.5].values, greens[0]))
+
+
+if __name__ == '__main__':
+	run_tests()
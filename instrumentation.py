@@ -0,0 +1,134 @@
+"""Count and time the calls on the hot path of an integration, to see whether a run is bound by noise generation, derivative evaluation or recording.
+
+Nothing is instrumented until an instrumentation is enabled.  Enabling one replaces the methods below, in the classes that define them and all of their subclasses, with wrappers that count and time the calls; disabling it puts the methods back, so that there is no cost once it is done.  Classes defined while it is enabled are not instrumented.
+
+Example:
+from kubo import *
+from integration import *
+from instrumentation import *
+state = KuboAmplitudes(KuboOscillator(0.5), 10000)
+state.set_amplitude(1.5)
+state.noise = numpyNoise()
+with instrumentation() as counts:
+	semi_implicit_integrator(0.01)(state, 5, record(1, ["amplitude_moment"]))
+print counts.summary()
+"""
+
+from dynamics import *
+from integration import stepwise_integrator, exact_integrator
+from time import time as wall_clock
+
+
+# The methods to instrument, by phase, and the classes in whose hierarchies they are found
+phases = [
+	('derivative', ensemble, ['derivative', 'weight_log_derivative']),
+	('noise', noise, ['derivatives']),
+	('record', record, ['add', 'add_samples', 'merge']),
+	('advance', stepwise_integrator, ['advance']),
+	('advance', exact_integrator, ['integrate_until']),
+	('allocation', ensemble, ['spare', 'part', 'advanced', 'advanced_exactly'])]
+
+
+class instrumentation(object):
+
+	"""I count and time calls by phase, and by method.  Times are exclusive, so time spent evaluating derivatives within an advance is not counted as advancing.  When a phase calls itself, as blockNoise does its parent's derivatives, only the outermost call is counted.
+
+	Steps are the calls to advance.  Allocations are the calls that make ensembles."""
+
+	def __init__(self):
+		self.patched = []
+		self.kinds, self.calls, self.seconds = {}, {}, {}
+		self.stack = []
+		self.elapsed, self.enabled_at = 0., None
+
+	def reset(self):
+		"Forget the calls so far"
+		self.calls.clear()
+		self.seconds.clear()
+		self.elapsed = 0.
+		if self.enabled_at is not None:
+			self.enabled_at = wall_clock()
+
+	def enable(self):
+		assert not self.patched, "Already enabled"
+		for phase, base, names in phases:
+			for cls in hierarchy(base):
+				for name in names:
+					if name in cls.__dict__:
+						key = cls.__name__ + '.' + name
+						self.kinds[key] = phase
+						self.patched.append((cls, name, cls.__dict__[name]))
+						setattr(cls, name, self.wrapper(phase, key, cls.__dict__[name]))
+		self.enabled_at = wall_clock()
+		return self
+
+	def disable(self):
+		if self.enabled_at is None:
+			return
+		for cls, name, original in reversed(self.patched):
+			setattr(cls, name, original)
+		self.patched = []
+		self.elapsed += wall_clock() - self.enabled_at
+		self.enabled_at = None
+
+	def __enter__(self):
+		return self.enable()
+
+	def __exit__(self, kind, value, traceback):
+		self.disable()
+
+	def wrapper(self, phase, key, method):
+		calls, seconds, stack = self.calls, self.seconds, self.stack
+		def instrumented(*arguments, **keywords):
+			if stack and stack[-1][0] == phase:
+				return method(*arguments, **keywords)
+			frame = [phase, 0.]
+			stack.append(frame)
+			start = wall_clock()
+			try:
+				return method(*arguments, **keywords)
+			finally:
+				duration = wall_clock() - start
+				stack.pop()
+				if stack:
+					stack[-1][1] += duration
+				calls[key] = calls.get(key, 0) + 1
+				seconds[key] = seconds.get(key, 0.) + duration - frame[1]
+		instrumented.__name__, instrumented.__doc__ = method.__name__, method.__doc__
+		return instrumented
+
+	def wall_time(self):
+		return self.elapsed + (0. if self.enabled_at is None else wall_clock() - self.enabled_at)
+
+	def report(self):
+		"""Answer a dictionary of the totals so far: for each phase, and for each method, the calls and the exclusive seconds, and the wall time, steps per second, and allocations.
+
+		This can be called while I am enabled."""
+		by_phase = dict((phase, {'calls': 0, 'seconds': 0.}) for phase, base, names in phases)
+		for key, count in self.calls.items():
+			by_phase[self.kinds[key]]['calls'] += count
+			by_phase[self.kinds[key]]['seconds'] += self.seconds[key]
+		wall = self.wall_time()
+		return {
+			'phases': by_phase,
+			'methods': dict((key, {'calls': self.calls[key], 'seconds': self.seconds[key]}) for key in self.calls),
+			'wall_time': wall,
+			'steps_per_second': by_phase['advance']['calls']/wall if wall > 0 else 0.,
+			'allocations': by_phase['allocation']['calls']}
+
+	def summary(self):
+		"The report, as a table"
+		report = self.report()
+		lines = ['phase\tcalls\tseconds\tfraction']
+		for phase, totals in sorted(report['phases'].items(), key = lambda item: -item[1]['seconds']):
+			lines.append('%s\t%d\t%.3g\t%.2f' % (phase, totals['calls'], totals['seconds'], totals['seconds']/report['wall_time'] if report['wall_time'] > 0 else 0))
+		lines.append('%.3g steps per second, %d allocations, %.3g seconds' % (report['steps_per_second'], report['allocations'], report['wall_time']))
+		return '\n'.join(lines)
+
+
+def hierarchy(cls):
+	"Answer cls and all of its subclasses"
+	result = [cls]
+	for sub in cls.__subclasses__():
+		result.extend(c for c in hierarchy(sub) if c not in result)
+	return result
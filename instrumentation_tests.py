@@ -0,0 +1,59 @@
+from namespace import *
+from kubo import *
+from integration import *
+from instrumentation import *
+
+
+class TestInstrumentation(TestCase):
+
+	def setUp(self):
+		self.state = KuboAmplitudes(KuboOscillator(0.5), 20)
+		self.state.set_amplitude(1.5)
+		self.state.noise = counterNoise(3, 0.05)
+		
+	def testCounts(self):
+		"Each semi-implicit step evaluates 4 midpoint derivatives and one for the step, each with its noise"
+		with instrumentation() as counts:
+			semi_implicit_integrator(0.05)(self.state, 1, record(0.5, ["amplitude_moment"]))
+		report = counts.report()
+		steps = report['phases']['advance']['calls']
+		self.assertEqual(steps, 20)
+		self.assertEqual(report['phases']['derivative']['calls'], 5*steps)
+		self.assertEqual(report['phases']['noise']['calls'], 5*steps)
+		self.assertEqual(report['phases']['record']['calls'], 3)
+		self.assertEqual(report['allocations'], 4)
+		self.assertEqual(report['methods']['KuboAmplitudes.derivative']['calls'], 5*steps)
+		self.assertTrue(sum(p['seconds'] for p in report['phases'].values()) <= report['wall_time'])
+		self.assertTrue(report['steps_per_second'] > 0)
+		self.assertTrue('steps per second' in counts.summary())
+		
+	def testRestored(self):
+		"Disabling puts back the original methods"
+		original = KuboAmplitudes.__dict__['derivative'], semi_implicit_integrator.__dict__['advance']
+		counts = instrumentation().enable()
+		self.assertFalse(KuboAmplitudes.__dict__['derivative'] is original[0])
+		counts.disable()
+		self.assertTrue(KuboAmplitudes.__dict__['derivative'] is original[0])
+		self.assertTrue(semi_implicit_integrator.__dict__['advance'] is original[1])
+		semi_implicit_integrator(0.05)(self.state, 1, record(0.5, ["amplitude_moment"]))
+		self.assertEqual(counts.calls, {})
+		
+	def testNested(self):
+		"The steps of the adaptive integrator's method are not counted as steps"
+		self.state.noise = bridgeNoise(3)
+		with instrumentation() as counts:
+			integrator = adaptive_integrator(0.05, 1e-3)
+			integrator(self.state, 1, record(0.5, ["amplitude_moment"]))
+		self.assertEqual(counts.report()['phases']['advance']['calls'], integrator.accepted)
+		
+	def testReset(self):
+		with instrumentation() as counts:
+			semi_implicit_integrator(0.05)(self.state, 0.5, record(0.5, ["amplitude_moment"]))
+			counts.reset()
+			self.assertEqual(counts.report()['phases']['derivative']['calls'], 0)
+			semi_implicit_integrator(0.05)(self.state, 0.5, record(0.5, ["amplitude_moment"]))
+		self.assertTrue(counts.report()['phases']['derivative']['calls'] > 0)
+
+
+if __name__ == '__main__':
+	run_tests()
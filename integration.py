@@ -8,41 +8,215 @@ integrate = semi_implicit_integrator(0.01)
 numerical = record(1, ["amplitude_moment", "expected_amplitude"])
 integrate(state, 5, numerical)
 numerical.results['amplitude_moment'][2.0].values
+
+A long run can be checkpointed, and resumed after the process is killed:
+integrate(state, 5, numerical, checkpoint('kubo.checkpoint', 600))
+numerical = resume('kubo.checkpoint')
 """
 
-def integrate_exactly(state, duration, record):
-	"record.after rounds up, record.next assumes time is close to recording time"
-	end = state.time + duration
-	final = state.advanced_exactly(record.after(state.time))
-	while final.time <= end:
-		record.add(final)
-		final = state.advanced_exactly(record.next(final.time))
-	if final.time <= end:
-		record.add(final)
-		
+from namespace import *
+import numpy.random
+import cPickle as pickle
+import os
+from time import time as wall_clock
+
+
+class checkpoint(object):
+
+	"""I save the progress of an integration to the file path, at most every interval seconds, so that it can be resumed after the process is killed.
+
+	The progress is the integrator, and the arguments to its integrate_until method: the state, noise included, the time to stop, the next sampling time, and the record.  The state of numpy.random is saved too, for noise drawn from it.  Resuming gives the same results as a run that was never interrupted."""
+
+	def __init__(self, path, interval = 600):
+		self.path = path
+		self.interval = interval
+		self.saved = wall_clock()
+
+	def due(self):
+		return wall_clock() - self.saved >= self.interval
+
+	def save(self, integrator, *arguments):
+		progress = {'integrator': integrator, 'arguments': arguments, 'random_state': numpy.random.get_state()}
+		temporary = self.path + '.new'
+		with open(temporary, 'wb') as stream:
+			pickle.dump(progress, stream, pickle.HIGHEST_PROTOCOL)
+		os.rename(temporary, self.path)
+		self.saved = wall_clock()
+
+	def load(self):
+		"Answer the integrator and the arguments to continue it with, and restore numpy.random"
+		with open(self.path, 'rb') as stream:
+			progress = pickle.load(stream)
+		numpy.random.set_state(progress['random_state'])
+		return progress['integrator'], progress['arguments']
+
+
+def resume(path, interval = 600):
+	"Continue the integration saved at path, checkpointing it there as before, and answer the record"
+	saved = checkpoint(path, interval)
+	integrator, arguments = saved.load()
+	integrator.integrate_until(*arguments, checkpoint = saved)
+	return arguments[-1]
+
+
+class exact_integrator(object):
+
+	"""I integrate states that know how to advance themselves exactly.  Each sample is advanced from the initial state, so there is nothing to keep between samples."""
+
+	def __call__(self, state, duration, record, checkpoint = None):
+		"record.after rounds up, record.next assumes time is close to recording time"
+		self.integrate_until(state, state.time + duration, record.after(state.time), record, checkpoint)
+
+	def integrate_until(self, state, end, target, record, checkpoint = None):
+		final = state.advanced_exactly(target)
+		while final.time <= end:
+			record.add(final)
+			target = record.next(final.time)
+			if checkpoint is not None and checkpoint.due():
+				checkpoint.save(self, state, end, target, record)
+			final = state.advanced_exactly(target)
+		if final.time <= end:
+			record.add(final)
+
+integrate_exactly = exact_integrator()
+
 
 class stepwise_integrator(object):
 
+	resampler = None		# Such as a systematicResampling, to rebalance weighted ensembles after each step
+
 	def __init__(self, timestep):
 		self.step = timestep
+		self.pool = None
 
-	def __call__(self, state, duration, record):
-		final_time = state.time + duration
-		sample_time = record.after(state.time)
+	def __call__(self, state, duration, record, checkpoint = None):
+		self.reset()
+		self.integrate_until(state, state.time + duration, record.after(state.time), record, checkpoint)
+		
+	def reset(self):
+		"Forget the workspace and the statistics of the last run"
+		self.pool = None
+		
+	def integrate_until(self, state, final_time, sample_time, record, checkpoint = None):
+		"Advance state to final_time, adding it to record at sample_time and each sampling time after.  If checkpoint is given, my progress is saved when it is due."
 		while state.time < final_time:
-			while state.time < min(final_time, sample_time):
+			target = min(final_time, sample_time)
+			while state.time < target:
 				state = self.advance(state)
+				if abs(state.time - target) < 1e-6*self.step:
+					state.time = target		# Rounding in the sum of the steps would otherwise cost an extra step
+				if self.resampler is not None:
+					self.resampler(state)
+				if checkpoint is not None and checkpoint.due():
+					checkpoint.save(self, state, final_time, sample_time, record)
 			if state.time >= sample_time:
 				record.add(state)
 			sample_time = record.next(state.time)
+			
+	def __getstate__(self):
+		# The workspace is rebuilt on demand, and the state being integrated is saved separately
+		result = self.__dict__.copy()
+		result['pool'] = None
+		return result
+			
+	def workspace(self, state, count):
+		"""Answer count spare ensembles to advance state with, followed by one to store the result in.
+		
+		These are kept between steps.  The result alternates between two ensembles, so it is never state, which was the result of the last step."""
+		if self.pool is None:
+			self.pool = [state.spare() for i in range(count+2)]
+		final = self.pool[-2] if state is self.pool[-1] else self.pool[-1]
+		return self.pool[:count] + [final]
 
 	
 class semi_implicit_integrator(stepwise_integrator):
 
+	"""By default, I iterate the midpoint a fixed number of times each step.  If a tolerance is given, I stop iterating once the midpoint changes by less than that, or after iterations, whichever comes first.  The number of steps that used each number of iterations is kept in iteration_counts, a histogram indexed by the number of iterations, so it stays the same size however long the run."""
+
 	# This requires noise be somewhat reproducible.  See noise_tests.py:/TestTwice/.
+	
+	def __init__(self, timestep, tolerance = None, iterations = 4):
+		stepwise_integrator.__init__(self, timestep)
+		self.tolerance = tolerance
+		self.iterations = iterations
+		self.iteration_counts = [0]*(iterations + 1)
+		
+	def reset(self):
+		stepwise_integrator.reset(self)
+		self.iteration_counts = [0]*(self.iterations + 1)
+		
+	def advance(self, state, step = None, out = None):
+		"Answer state advanced by step, which defaults to my timestep.  The result is stored in out if that is given, otherwise in my workspace."
+		if step is None:
+			step = self.step
+		halfstep, spare, final = self.workspace(state, 2)
+		if out is not None:
+			final = out
+		state.advance_into(0.5*step, state, halfstep)
+		count = 1
+		while count < self.iterations:
+			state.advance_into(0.5*step, halfstep, spare)
+			halfstep, spare = spare, halfstep
+			count += 1
+			if self.tolerance is not None and halfstep.distance(spare) < self.tolerance:
+				break
+		self.iteration_counts[count] += 1
+		return state.advance_into(step, halfstep, final)
+
+
+class adaptive_integrator(stepwise_integrator):
+
+	"""I choose each timestep to keep the local error below tolerance.  The error of a step is estimated by comparing one step of method with two half steps, and the result of the half steps is kept.  Method defaults to a semi_implicit_integrator.
+	
+	The noise of the state must be a bridgeNoise, so that the half steps refine the same Wiener path as the whole step.  The timestep is the first one tried.  Steps are shortened to land exactly on the sampling times of the record.  The numbers of accepted and rejected steps are kept in accepted and rejected."""
+	
+	def __init__(self, timestep, tolerance, method = None, smallest = None):
+		stepwise_integrator.__init__(self, timestep)
+		self.first_step = timestep
+		self.tolerance = tolerance
+		self.method = semi_implicit_integrator(timestep) if method is None else method
+		self.smallest = 1e-6*timestep if smallest is None else smallest
+		self.accepted = self.rejected = 0
+		
+	def __call__(self, state, duration, record, checkpoint = None):
+		self.reset()
+		self.method.reset()
+		self.step = self.first_step
+		self.accepted = self.rejected = 0
+		self.integrate_until(state, state.time + duration, record.after(state.time), record, checkpoint)
 		
-	def advance(self, state):
-		halfstep = state
-		for i in range(4):
-			halfstep = state.advanced(0.5*self.step, halfstep)
-		return state.advanced(self.step, halfstep)
+	def integrate_until(self, state, final_time, sample_time, record, checkpoint = None):
+		while state.time < final_time:
+			target = min(final_time, sample_time)
+			while state.time < target:
+				state = self.advance(state, target)
+				if self.resampler is not None:
+					self.resampler(state)
+				if checkpoint is not None and checkpoint.due():
+					checkpoint.save(self, state, final_time, sample_time, record)
+			if state.time >= sample_time:
+				record.add(state)
+			sample_time = record.next(state.time)
+			
+	def advance(self, state, target = None):
+		"Take one step from state, no further than the time target, with acceptable error"
+		whole, middle, final = self.workspace(state, 2)
+		while True:
+			step = self.step if target is None else min(self.step, target - state.time)
+			self.method.advance(state, step, whole)
+			self.method.advance(state, 0.5*step, middle)
+			self.method.advance(middle, 0.5*step, final)
+			error = whole.distance(final)
+			factor = 1.5 if error == 0 else min(1.5, max(0.2, 0.8*sqrt(self.tolerance/error)))
+			if error <= self.tolerance or step <= self.smallest:
+				break
+			self.rejected += 1
+			self.step = step*factor
+		self.accepted += 1
+		if step == self.step or factor < 1:
+			self.step = step*factor
+		if target is not None and step == target - state.time:
+			final.time = target
+		if hasattr(state.noise, 'forget'):
+			state.noise.forget(final.time)
+		return final
@@ -0,0 +1,360 @@
+from namespace import *
+from kubo import *
+from integration import *
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+import numpy.random
+from numpy import bincount, std, isfinite, log, finfo
+
+
+def kubo_state(size = 20, seed = 3):
+	state = KuboAmplitudes(KuboOscillator(0.5), size)
+	state.set_amplitude(1.5)
+	state.noise = counterNoise(seed, 0.01)
+	return state
+
+
+class diffusingWeights(weightedEnsemble):
+	"Fixed representations, whose weights take independent random walks, so that they degenerate"
+
+	def derivative(self, noise):
+		return zeros_like(self.representations)
+
+	def weight_log_derivative(self, noise):
+		return noise[0:self.size]
+
+	def moment(self):
+		return weightings(self.representations, log_weights = self.log_weights, signs = self.signs)
+
+class growingWeights(diffusingWeights):
+	"Weights that grow by a factor of about exp(5) every step of 0.05"
+
+	def weight_log_derivative(self, noise):
+		return 100 + noise[0:self.size]
+
+class shrinkingWeights(diffusingWeights):
+	"Weights whose log derivative times a step of 0.05 is far below -1"
+
+	def weight_log_derivative(self, noise):
+		return -100 + noise[0:self.size]
+
+def diffusing_state(size = 200, seed = 3):
+	state = diffusingWeights(None, size)
+	state.representations = arange(size, dtype = float)
+	state.weights = ones(size)
+	state.noise = counterNoise(seed, 0.05)
+	return state
+
+
+class TestInPlace(TestCase):
+
+	def setUp(self):
+		self.state = kubo_state()
+
+	def testAdvanceInto(self):
+		"Advancing into a spare ensemble agrees with advanced"
+		out = self.state.spare()
+		self.assertTrue(self.state.advance_into(0.01, self.state, out) is out)
+		self.assertEqual(out.time, self.state.advanced(0.01).time)
+		self.assertTrue((out.representations == self.state.advanced(0.01).representations).all())
+		self.assertTrue((self.state.representations == 1.5).all())
+
+	def testWorkspace(self):
+		"The semi-implicit integrator reuses the same ensembles every step"
+		integrate = semi_implicit_integrator(0.01)
+		first = integrate.advance(self.state)
+		second = integrate.advance(first)
+		third = integrate.advance(second)
+		self.assertEqual(len(integrate.pool), 4)
+		self.assertFalse(first is second)
+		self.assertTrue(first is third)
+
+	def testRecordCopies(self):
+		"Recorded moments are not overwritten when the integrator reuses its ensembles"
+		result = record(0.05, ["amplitude_moment"])
+		semi_implicit_integrator(0.01)(self.state, 0.2, result)
+		moments = result.results["amplitude_moment"]
+		self.assertTrue((moments[0.].values == 1.5).all())
+		self.assertFalse((moments[0.1].values == moments[0.2].values).any())
+
+
+class TestConvergence(TestCase):
+
+	def setUp(self):
+		self.state = kubo_state()
+
+	def testFixed(self):
+		"Without a tolerance, every step iterates the midpoint four times"
+		integrate = semi_implicit_integrator(0.01)
+		integrate(self.state, 0.1, record(0.05, []))
+		self.assertTrue(integrate.iteration_counts[4] >= 10)
+		self.assertEqual(sum(integrate.iteration_counts), integrate.iteration_counts[4])
+
+	def testTolerance(self):
+		"A loose tolerance stops early, and agrees with the fixed iteration to about that tolerance"
+		fixed, converged = semi_implicit_integrator(0.01), semi_implicit_integrator(0.01, tolerance = 1e-2)
+		fixed_record, converged_record = record(0.1, ["amplitude_moment"]), record(0.1, ["amplitude_moment"])
+		fixed(self.state, 0.1, fixed_record)
+		converged(self.state, 0.1, converged_record)
+		counts = converged.iteration_counts
+		self.assertTrue(sum(k*n for k, n in enumerate(counts)) < 4*sum(counts))
+		difference = fixed_record.results["amplitude_moment"][0.1].values - converged_record.results["amplitude_moment"][0.1].values
+		self.assertTrue(abs(difference).max() < 1e-2)
+
+	def testCap(self):
+		"An unattainable tolerance iterates up to the cap"
+		integrate = semi_implicit_integrator(0.01, tolerance = 0., iterations = 7)
+		integrate(self.state, 0.05, record(0.05, []))
+		self.assertEqual(sum(integrate.iteration_counts), integrate.iteration_counts[7])
+
+	def testBounded(self):
+		"The counts are a histogram, which does not grow with the run, and start again with each run"
+		integrate = semi_implicit_integrator(0.01)
+		integrate(self.state, 0.5, record(0.5, []))
+		integrate(self.state, 0.1, record(0.1, []))
+		self.assertEqual(len(integrate.iteration_counts), 5)
+		self.assertEqual(integrate.iteration_counts[4], 10)
+
+	def testStepCount(self):
+		"Ten steps of 0.1 reach 1, although their sum in floating point falls short of it"
+		integrate = semi_implicit_integrator(0.1)
+		result = record(1, ["amplitude_moment"])
+		integrate(self.state, 1, result)
+		self.assertEqual(sum(integrate.iteration_counts), 10)
+		self.assertEqual(sorted(result.results["amplitude_moment"].keys()), [0., 1.])
+
+	def testStrong(self):
+		"With a counterNoise, the elements converge to the exact solution along their own Wiener paths, with error proportional to the timestep"
+		errors = []
+		for h in 0.04, 0.02, 0.01:
+			state = kubo_state(200)
+			state.noise = counterNoise(3, h)
+			exact = state.sample_exactly([1.])[0]
+			results = record(1, ["amplitude_moment"])
+			semi_implicit_integrator(h)(state, 1, results)
+			errors.append(abs(results.results["amplitude_moment"][1].values - exact).mean())
+		self.assertTrue(errors[0] > 1.5*errors[1] > 2.25*errors[2])
+		self.assertTrue(errors[2] < 0.01)
+
+	def testOffGrid(self):
+		"A step of three noise steps has a midpoint off the grid of the noise, which is refused"
+		self.state.noise = counterNoise(5, 0.01)
+		self.assertRaises(ValueError, semi_implicit_integrator(0.03), self.state, 0.3, record(0.3, []))
+		semi_implicit_integrator(0.02)(self.state, 0.3, record(0.3, []))
+
+	def testBlockNoise(self):
+		"With a blockNoise, the mean agrees with the exact moment within the sampling error"
+		state = kubo_state(10000)
+		state.noise = blockNoise(0.01, seed = 5)
+		results = record(1, ["amplitude_moment"])
+		semi_implicit_integrator(0.01)(state, 1, results)
+		values = results.results["amplitude_moment"][1].values
+		exact = state.system.moment(1.5, 1, 0, array([1.]))[0]
+		self.assertTrue(abs(values.mean() - exact) < 4*values.std()/100)
+
+
+class TestAdaptive(TestCase):
+
+	def setUp(self):
+		self.state = kubo_state(10)
+		self.state.noise = bridgeNoise(seed = 5)
+		
+	def testSamplingTimes(self):
+		"Steps land on the sampling times"
+		result = record(0.5, ["amplitude_moment"])
+		integrate = adaptive_integrator(0.3, 0.05)
+		integrate(self.state, 2, result)
+		self.assertEqual(sorted(result.results["amplitude_moment"].keys()), [0., 0.5, 1., 1.5, 2.])
+		self.assertTrue(integrate.accepted >= 7)
+		
+	def testMethodCounts(self):
+		"The iteration counts of the method start again with each run, and cover the three steps of each attempt"
+		integrate = adaptive_integrator(0.3, 0.05)
+		integrate(self.state, 1, record(0.5, []))
+		integrate(self.state, 0.5, record(0.5, []))
+		self.assertEqual(sum(integrate.method.iteration_counts), 3*(integrate.accepted + integrate.rejected))
+		
+	def testTolerance(self):
+		"Tightening the tolerance takes more steps, and approaches the exact solution on the same Wiener path"
+		errors, steps = [], []
+		for tolerance in 0.1, 0.003:
+			state = kubo_state(10)
+			state.noise = bridgeNoise(seed = 5)
+			state.noise.forget = lambda t: None
+			result = record(1, ["amplitude_moment"])
+			integrate = adaptive_integrator(0.1, tolerance)
+			integrate(state, 1, result)
+			W = state.noise.path((slice(0, 10),), 1.) - state.noise.path((slice(0, 10),), 0.)
+			exact = 1.5*exp(1j*(0.5 + W))
+			errors.append(abs(result.results["amplitude_moment"][1.].values - exact).max())
+			steps.append(integrate.accepted)
+		self.assertTrue(steps[1] > steps[0])
+		self.assertTrue(errors[1] < errors[0])
+
+
+class Killed(Exception):
+	pass
+	
+class interrupting(checkpoint):
+
+	"I save the progress every time it is due, and kill the run after the saves given"
+	
+	def __init__(self, path, saves):
+		checkpoint.__init__(self, path, 0)
+		self.saves = saves
+		
+	def save(self, *progress):
+		checkpoint.save(self, *progress)
+		self.saves -= 1
+		if self.saves == 0:
+			raise Killed
+
+
+class TestCheckpoint(TestCase):
+
+	def setUp(self):
+		self.directory = mkdtemp()
+		self.path = os.path.join(self.directory, 'run.checkpoint')
+		
+	def tearDown(self):
+		rmtree(self.directory)
+		
+	def check(self, integrator, noise, saves, duration = 0.5):
+		"Killing and resuming a run gives the same results as running it through"
+		results = []
+		for interrupt in False, True:
+			numpy.random.seed(11)
+			state = kubo_state(10)
+			state.noise = noise()
+			result = record(0.1, ["amplitude_moment"])
+			if interrupt:
+				self.assertRaises(Killed, integrator, state, duration, result, interrupting(self.path, saves))
+				numpy.random.seed(12)
+				result = resume(self.path, 0)
+			else:
+				integrator(state, duration, result)
+			results.append(result.results["amplitude_moment"])
+		self.assertEqual(sorted(results[0].keys()), sorted(results[1].keys()))
+		for t in results[0]:
+			self.assertTrue((results[0][t].values == results[1][t].values).all())
+			
+	def testSemiImplicit(self):
+		self.check(semi_implicit_integrator(0.01), lambda: counterNoise(3, 0.01), 17)
+		
+	def testGlobalNoise(self):
+		"The position of numpy.random is restored"
+		self.check(semi_implicit_integrator(0.01), numpyNoise, 23)
+		
+	def testBlockNoise(self):
+		self.check(semi_implicit_integrator(0.01), lambda: blockNoise(0.01, 16, seed = 4), 30)
+		
+	def testAdaptive(self):
+		self.check(adaptive_integrator(0.05, 0.01), lambda: bridgeNoise(seed = 5), 4)
+		
+	def testExact(self):
+		self.check(integrate_exactly, lambda: numpyNoise(seed = 6), 2)
+
+
+
+class TestLogWeights(TestCase):
+
+	def testGrowth(self):
+		"Weights that grow past the range of floating point are still recorded"
+		state = diffusing_state(100)
+		state.__class__ = growingWeights
+		results = momentRecord(1, ["moment"])
+		semi_implicit_integrator(0.05)(state, 25, results)
+		final = results.results["moment"][25.]
+		self.assertTrue(final.log_weight() > log(finfo(float).max))
+		self.assertTrue(isfinite(final.mean()).all())
+		self.assertTrue(0 <= final.mean() < 100)
+
+	def testShrinking(self):
+		"A large negative log derivative shrinks the weights by its exponential, and does not make them negative or NaN"
+		state = diffusing_state(100)
+		state.__class__ = shrinkingWeights
+		results = momentRecord(1, ["moment"])
+		semi_implicit_integrator(0.05)(state, 10, results)
+		final = results.results["moment"][10.]
+		self.assertTrue(isfinite(final.log_weight()))
+		self.assertTrue(abs(final.log_weight() + 1000) < 30)
+		self.assertTrue(isfinite(final.mean()).all())
+		self.assertTrue(0 <= final.mean() < 100)
+
+	def testSigns(self):
+		"Negative weights keep their signs through the steps"
+		state = diffusing_state(100)
+		weights = ones(100)
+		weights[::4] = -1
+		state.weights = weights
+		results = record(1, ["moment"])
+		semi_implicit_integrator(0.05)(state, 2, results)
+		for t in 0., 1., 2.:
+			self.assertTrue((results.results["moment"][t].signs == weights).all())
+		self.assertTrue((state.signs == weights).all())
+
+
+class TestResampling(TestCase):
+
+	def setUp(self):
+		source = RandomState(8)
+		self.state = diffusing_state(50)
+		weights = source.exponential(1, 50)**3
+		weights[::7] *= -1
+		self.state.weights = weights
+
+	def testBranch(self):
+		"The total magnitude of the weights is kept, their signs follow the elements, and they become equal in magnitude"
+		total = abs(self.state.weights).sum()
+		for resampler in systematicResampling(1, 4), residualResampling(1, 4):
+			state = self.state.part(0, 50)
+			self.assertTrue(resampler(state))
+			self.assertTrue(allclose(abs(state.weights), total/50))
+			self.assertTrue(allclose(state.effective_size(), 50))
+			signs = self.state.weights[state.representations.astype(int)] > 0
+			self.assertTrue(((state.weights > 0) == signs).all())
+			self.assertTrue((self.state.weights[::7] < 0).all())
+
+	def testThreshold(self):
+		resampler = systematicResampling(0.01, 4)
+		self.assertFalse(resampler(self.state))
+		self.assertEqual(resampler.resamplings, 0)
+
+	def testResidual(self):
+		"Residual resampling copies every element at least floor(size p) times"
+		state = self.state.part(0, 50)
+		residualResampling(1, 4)(state)
+		floors = (50*abs(self.state.weights)/abs(self.state.weights).sum()).astype(int)
+		copies = bincount(state.representations.astype(int), minlength = 50)
+		self.assertTrue((copies >= floors).all())
+
+	def testUnbiased(self):
+		"On average over resamplings, the weighted mean is unchanged"
+		mean = average(self.state.representations, weights = self.state.weights)
+		for resampler in systematicResampling(1, 5), residualResampling(1, 5):
+			means = []
+			for k in range(400):
+				state = self.state.part(0, 50)
+				resampler(state)
+				means.append(average(state.representations, weights = state.weights))
+			self.assertTrue(abs(average(means) - mean) < 4*std(means)/20)
+
+	def testIntegrator(self):
+		"An integrator with a resampler keeps the effective size above the threshold"
+		integrate = semi_implicit_integrator(0.05)
+		integrate.resampler = systematicResampling(0.5, 3)
+		sizes = []
+		results = record(1, [])
+		results.add = lambda state: sizes.append(state.effective_size())
+		integrate(diffusing_state(), 10, results)
+		self.assertTrue(integrate.resampler.resamplings > 0)
+		self.assertEqual(len(sizes), 11)
+		self.assertTrue(min(sizes) >= 100)
+		del sizes[:]
+		semi_implicit_integrator(0.05)(diffusing_state(), 10, results)
+		self.assertTrue(sizes[-1] < 100)
+
+
+if __name__ == '__main__':
+	run_tests()
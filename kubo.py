@@ -1,17 +1,53 @@
 """System and representation for the Kubo oscillator.  To be made parallel, as a CUDA exercise."""
 
 from dynamics import *
+from numpy import cumsum, diff, minimum, asarray
+from collections import OrderedDict
 
 class KuboOscillator(object):
+
+	"""I compute exact moments of the amplitude x = x0 exp(i(wt + W)), where W is a Wiener process started at time 0.
+	
+	Moments are evaluated for whole arrays of times, and the last cache_size of them are remembered by their parameters and times, so that comparing a record with them repeatedly costs a lookup, while runs that sample many different times don't grow the memo without bound.  The results are shared, and must not be modified."""
+	
+	cache_size = 32
+	
 	def __init__(self, resonance_frequency):
 		self.w = resonance_frequency
+		self.cache = OrderedDict()		# Least recently used first
+		
+	def moment(self, x0, p, q, times):
+		"E[x^p conj(x)^q] at each of times"
+		return self.correlation(x0, p, q, times, times)
+		
+	def correlation(self, x0, p, q, t, s):
+		"""E[x(t)^p conj(x(s))^q], for arrays t and s that broadcast together.
+		
+		The phase p(wt + W(t)) - q(ws + W(s)) is normal, with variance p^2 t + q^2 s - 2pq min(t, s)."""
+		t, s = asarray(t, dtype = float), asarray(s, dtype = float)
+		key = (x0, p, q, t.shape, t.tostring(), s.shape, s.tostring())
+		result = self.cache.pop(key, None)
+		if result is None:
+			variance = p*p*t + q*q*s - 2*p*q*minimum(t, s)
+			result = asarray(x0**p * x0.conjugate()**q * exp(1j*self.w*(p*t - q*s) - 0.5*variance))
+			result.flags.writeable = False
+		self.cache[key] = result
+		if len(self.cache) > self.cache_size:
+			self.cache.popitem(last = False)
+		return result
+		
+	def __getstate__(self):
+		# Workers of a parallel run rebuild the cache
+		result = self.__dict__.copy()
+		result['cache'] = OrderedDict()
+		return result
 
 
 class KuboAmplitudes(ensemble):
 
 	def set_amplitude(self, x0):
 		self.initial_amplitude = x0
-		self.representations = empty_array(self.size)
+		self.representations = empty_array(self.size, dtype = result_type(x0, float))
 		self.representations[:] = x0
 		
 	def derivative(self, noise):
@@ -25,9 +61,56 @@ class KuboAmplitudes(ensemble):
 			exp(1j * (self.system.w + noise[0:self.size]) * duration)
 		return final
 		
+	def sample_exactly(self, times, block = 256):
+		"""Answer the amplitudes of my elements at each of times, which are in order and no earlier than my time, as a (times x ensemble) array.
+		
+		The phases are cumulative sums of Wiener increments, computed for all times and elements at once.  If my noise is a counterNoise, the increments are its deviates on its grid of time steps, block steps at a time, so the samples lie on the same Wiener paths that the integrators follow, and the times should lie on the grid.  Otherwise, increments between the times are drawn from the generator of my noise, or from numpy.random."""
+		
+		times = array(times, dtype = float)
+		if isinstance(self.noise, counterNoise):
+			phases = self.path_on_grid(times, block)
+		else:
+			generator = getattr(self.noise, 'generator', None)
+			deviates = normal_deviates if generator is None else generator.normal
+			phases = deviates(0, 1, (times.size, self.size))
+			phases *= (diff(times, prepend = self.time)**0.5)[:,newaxis]
+			cumsum(phases, 0, out = phases)
+		phases += self.system.w*(times - self.time)[:,newaxis]
+		result = exp(1j*phases)
+		result *= self.representations
+		return result
+		
+	def path_on_grid(self, times, block):
+		"The Wiener processes at times, summed from the deviates of my counterNoise"
+		h = self.noise.timestep
+		first = self.noise.step_index(self.time)
+		ends = [self.noise.step_index(t) for t in times]
+		result = empty_array((times.size, self.size))
+		total = zeros(self.size)
+		k = 0
+		for start in range(first, ends[-1] if ends else first, block):
+			steps = arange(start, min(start + block, ends[-1]))
+			increments = self.noise.deviates((slice(0, self.size),), steps)
+			cumsum(increments, 0, out = increments)
+			increments += total
+			while k < len(ends) and ends[k] <= steps[-1] + 1:
+				result[k] = increments[ends[k] - start - 1] if ends[k] > start else total
+				k += 1
+			total = increments[-1]
+		result[k:] = total
+		result *= sqrt(h)
+		return result
+		
+	def record_exactly(self, duration, record):
+		"Sample my amplitudes exactly at the sampling times of record, up to duration after my time, and add them to record in bulk"
+		times, t = [], record.after(self.time)
+		while t <= self.time + duration:
+			times.append(t)
+			t = record.next(t)
+		record.add_samples("amplitude_moment", times, self.sample_exactly(times))
+		
 	def amplitude_moment(self):
 		return weightings(self.representations, ones(self.size))
 
 	def expected_amplitude(self):
-		x = self.initial_amplitude * exp(self.time*(1j*self.w-0.5))
-		return weightings(x, 1)
+		return weightings(self.system.moment(self.initial_amplitude, 1, 0, self.time)[()], 1)
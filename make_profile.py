@@ -1,8 +1,6 @@
 import cProfile
-from fermi_tests import *
+from benchmark import *
 
-moments = Record(timestep = 1)
-noise = DiscreteNoise(timestep = 0.01)
-system = figure_1_system()
-integrator = SemiImplicitIntegrator(system, noise, timestep = 0.01)
-cProfile.run('integrate_labels(integrator, system.initial(0.5), 3.1, moments, range(10))', 'profile.out')
+case = fermi_case(sites = (4, 4))
+integrator = semi_implicit_integrator(0.01)
+cProfile.run('run_benchmark(case, "semi_implicit", integrator, 0.01, 100)', 'profile.out')
@@ -2,11 +2,12 @@
 Import external classes and procedures used throughout cdprl, under the project's standard names.
 """
 
-from numpy import ndarray, array, newaxis, zeros, zeros_like, ones, empty_like, outer, tensordot, identity as unit, logical_or, allclose, empty as empty_array, append, average, exp
-from numpy.random import normal as normal_deviates
+from numpy import ndarray, array, arange, newaxis, zeros, zeros_like, ones, empty_like, outer, tensordot, identity as unit, logical_or, allclose, empty as empty_array, append, average, exp, matmul, int64, multiply, result_type
+from numpy.random import normal as normal_deviates, randint, RandomState
 from math import fabs, sqrt, copysign
 
 from operator import mul
 from copy import copy
+from bisect import bisect_left, bisect_right
 from itertools import product as cartesian_product
 from unittest import TestCase, main as run_tests
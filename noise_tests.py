@@ -59,5 +59,151 @@ class TestSpecialCases(SourceTest):
 	
 			
 
+class TestBlock(TestCase):
+
+	def setUp(self):
+		self.source = blockNoise(timestep = 0.1, block = 8, seed = 5)
+		
+	def testShape(self):
+		self.assertEqual(self.source[0:3,0:2](0.5,0.1).shape, (3,2))
+		self.assertEqual(self.source(0.5,0.1)[0:3].shape, (3,))
+		
+	def testTwice(self):
+		"Repeating an interval gives the same deviates, within a block and across a refill"
+		for t in 0, 0.7, 0.8, 1.5:
+			first = self.source[0:5](t,0.1)
+			second = self.source[0:5](t,0.1)
+			self.assertTrue((first == second).all())
+		
+	def testWithinStep(self):
+		"Any interval starting within a step sees the derivative of that step"
+		whole = self.source[0:5](0.5,0.1)
+		self.assertTrue((whole == self.source[0:5](0.5,0.05)).all())
+		self.assertTrue((whole == self.source[0:5](0.55,0.05)).all())
+		self.assertFalse((whole == self.source[0:5](0.6,0.05)).any())
+		
+	def testSeveralSteps(self):
+		"An interval of several steps sees the mean of their derivatives"
+		steps = [self.source[0:5](0.1*k,0.1) for k in 5, 6, 7]
+		self.assertTrue(allclose(self.source[0:5](0.5,0.3), sum(steps)/3))
+		
+	def testAcrossBlocks(self):
+		"An interval that crosses the end of a block gives the same values when repeated, and steps handed out before are kept"
+		source = blockNoise(timestep = 0.01, block = 4, seed = 1)
+		source[0:3](0.,0.01)
+		before = source[0:3](0.02,0.01)
+		self.assertEqual(source.first_step, 0)
+		first = source[0:3](0.02,0.03)
+		self.assertTrue((first == source[0:3](0.02,0.03)).all())
+		self.assertTrue((before == source[0:3](0.02,0.01)).all())
+		self.assertEqual(source.first_step, 2)
+		self.assertTrue(allclose(first, (before + source[0:3](0.03,0.01) + source[0:3](0.04,0.01))/3))
+		self.assertRaises(AssertionError, source[0:3], 0.06, 0.05)
+		
+	def testOffGrid(self):
+		self.assertRaises(ValueError, self.source[0:5], 0.5, 0.15)
+		
+	def testIndependentElements(self):
+		samples = array([self.source[0:3](0.1*t, 0.1) for t in range(30)])
+		self.assertEqual(len(set(samples.flatten())), samples.size)
+		self.assertTrue(abs(0.1*samples.var() - 1) < 0.3)
+		
+	def testSeeded(self):
+		other = blockNoise(timestep = 0.1, block = 8, seed = 5)
+		self.assertTrue((self.source[0:5](0.3,0.1) == other[0:5](0.3,0.1)).all())
+		
+	def testEmptyInterval(self):
+		self.assertEqual(0.* self.source[0:1](0.5,0.)[0], 0.)
+
+
+class TestBridge(TestCase):
+
+	def setUp(self):
+		self.source = bridgeNoise(seed = 2)
+		
+	def testTwice(self):
+		first = self.source[0:5](0.5,0.2)
+		self.source[0:5](0.7,0.2)
+		self.assertTrue((first == self.source[0:5](0.5,0.2)).all())
+		
+	def testRefinement(self):
+		"The increment over an interval is the sum of the increments over its halves, whichever is asked for first"
+		whole = 0.2*self.source[0:5](0.5,0.2)
+		halves = 0.1*self.source[0:5](0.5,0.1) + 0.1*self.source[0:5](0.6,0.1)
+		self.assertTrue(allclose(whole, halves))
+		halves = 0.1*self.source[0:5](1.5,0.1) + 0.1*self.source[0:5](1.6,0.1)
+		self.assertTrue(allclose(0.2*self.source[0:5](1.5,0.2), halves))
+		
+	def testIncrements(self):
+		"Increments over disjoint intervals are independent, with variance equal to the duration"
+		samples = array([self.source[0:100](0.1*t, 0.1) for t in range(30)])
+		self.assertTrue(abs(0.1*samples.var() - 1) < 0.1)
+		self.assertTrue(abs(0.01*(samples[1:]*samples[:-1]).mean()) < 0.1)
+		
+	def testForget(self):
+		self.source[0:5](0.1*1,0.1)
+		self.source[0:5](0.1*2,0.1)
+		later = self.source[0:5](0.5,0.1)
+		self.source.forget(0.5)
+		self.assertEqual(len(self.source.paths.values()[0][0]), 2)
+		self.assertTrue((later == self.source[0:5](0.5,0.1)).all())
+
+
+class TestCounter(TestCase):
+
+	def setUp(self):
+		self.source = counterNoise(seed = 11, timestep = 0.1)
+		
+	def testShape(self):
+		self.assertEqual(self.source[0:3,0:2](0.5,0.1).shape, (3,2))
+		self.assertEqual(self.source[2:9](0.5,0.1).shape, (7,))
+		
+	def testRepeatable(self):
+		"Any interval can be regenerated, not just the last one"
+		first = self.source[0:5](0.5,0.1)
+		self.source[0:5](0.6,0.1)
+		self.assertTrue((first == self.source[0:5](0.5,0.1)).all())
+		self.assertTrue((first == counterNoise(seed = 11, timestep = 0.1)[0:5](0.5,0.1)).all())
+		
+	def testWithinStep(self):
+		"Any interval starting within a step sees the derivative of that step"
+		whole = self.source[0:5](0.5,0.1)
+		self.assertTrue((whole == self.source[0:5](0.5,0.05)).all())
+		self.assertTrue((whole == self.source[0:5](0.55,0.05)).all())
+		self.assertFalse((whole == self.source[0:5](0.6,0.05)).any())
+		
+	def testSeveralSteps(self):
+		"An interval of several steps sees the mean of their derivatives"
+		steps = [self.source[0:5](0.1*k,0.1) for k in 5, 6, 7]
+		self.assertTrue(allclose(self.source[0:5](0.5,0.3), sum(steps)/3))
+		
+	def testOffGrid(self):
+		"Intervals longer than a step, which do not lie on the grid, are refused rather than rounded"
+		self.assertRaises(ValueError, self.source[0:5], 0.5, 0.15)
+		self.assertRaises(ValueError, self.source[0:5], 0.55, 0.2)
+		self.assertEqual(self.source[0:5](0.5, 0.1 + 1e-9).shape, (5,))
+		self.assertEqual(self.source[0:5](0.3*(1 + 1e-12), 0.3).shape, (5,))
+		
+	def testSlices(self):
+		"Processes have the same noise, however they are sliced"
+		whole = self.source[0:6,0:3](0.2,0.1)
+		self.assertTrue((whole[3:5,1:3] == self.source[3:5,1:3](0.2,0.1)).all())
+		self.assertTrue((whole[1:6,0:1] == self.source[1:6,0:1](0.2,0.1)).all())
+		
+	def testPart(self):
+		"Part of an ensemble sees the noise of its elements in the whole ensemble"
+		whole = self.source[0:10](0.3,0.1)
+		self.assertTrue((whole[4:7] == self.source.part(4, 7)[0:3](0.3,0.1)).all())
+		
+	def testIndependent(self):
+		samples = array([self.source[0:4](0.1*t, 0.1) for t in range(-5, 50)])
+		self.assertEqual(len(set(samples.flatten())), samples.size)
+		self.assertTrue(abs(0.1*samples.var() - 1) < 0.3)
+		
+	def testSeeds(self):
+		other = counterNoise(seed = 12, timestep = 0.1)
+		self.assertFalse((self.source[0:5](0.5,0.1) == other[0:5](0.5,0.1)).any())
+		
+
 if __name__ == '__main__':
     run_tests()
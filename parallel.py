@@ -0,0 +1,77 @@
+"""Integrate ensembles on a pool of processes.  Trajectories are independent, so each worker integrates a part of the ensemble, and the records are merged afterwards.
+
+Example:
+from kubo import *
+from integration import *
+from parallel import *
+state = KuboAmplitudes(KuboOscillator(0.5), 10000)
+state.set_amplitude(1.5)
+state.noise = numpyNoise(seed = 7)
+numerical = record(1, ["amplitude_moment", "expected_amplitude"])
+integrate_in_parallel(semi_implicit_integrator(0.01), state, 5, numerical)
+
+A sweep integrates an ensemble for every point of a grid of parameters:
+def prepare(system):
+	state = KuboAmplitudes(system, 1000)
+	state.set_amplitude(1.5)
+	return state
+points = sweep(KuboOscillator, {'resonance_frequency': [0.5, 1, 2]}, prepare, counterNoise(7, 0.01), semi_implicit_integrator(0.01), 5, record(1, ["amplitude_moment"]))
+"""
+
+from namespace import *
+from dynamics import counterNoise
+from multiprocessing import Pool, cpu_count
+
+
+def integrate_in_parallel(integrator, state, duration, record, workers = None):
+	"""Integrate state as integrator(state, duration, record) would, with the ensemble split into parts that are integrated by a pool of worker processes.
+
+	Each part has its own noise, from state.noise.part, so the run is reproducible when the noise is seeded.  The workers' records are merged into record in ensemble order."""
+
+	if workers is None:
+		workers = cpu_count()
+	tasks = [(integrator, state.part(start, stop), duration, record.empty()) for start, stop in partition(state.size, workers)]
+	for result in pool_map(integrate_part, tasks, workers):
+		record.merge(result)
+
+
+def sweep(base, grid, prepare, noise, integrator, duration, record, workers = None):
+	"""Integrate an ensemble for every point of grid, a dictionary of parameter names and lists of values, and answer a list of pairs of the point, as a dictionary, and its record.
+
+	The system for a point is base(**point) if base is callable, such as a class, and otherwise built from the model base as base.__class__(base, **point), which is how FermiHubbardSystem varies its parameters while sharing its operators.  Prepare(system) answers the ensemble to integrate.  Every point is integrated with the same noise, which must be a counterNoise, so that element k follows the same Wiener path at every point.  These common random numbers make differences between points much more accurate than independent runs would.  The records are record.empty(), and the points are shared out between a pool of workers."""
+
+	assert isinstance(noise, counterNoise), "Common random numbers need noise that every point can regenerate"
+	if workers is None:
+		workers = cpu_count()
+	names = sorted(grid.keys())
+	points = [dict(zip(names, values)) for values in cartesian_product(*[grid[name] for name in names])]
+	tasks = []
+	for point in points:
+		state = prepare(base(**point) if callable(base) else base.__class__(base, **point))
+		state.noise = noise
+		tasks.append((integrator, state, duration, record.empty()))
+	return zip(points, pool_map(integrate_part, tasks, workers))
+
+
+def integrate_part(task):
+	integrator, state, duration, record = task
+	integrator(state, duration, record)
+	return record
+
+
+def partition(size, parts):
+	"Split range(size) into at most parts nonempty slices of nearly equal length, answered as (start, stop) pairs"
+	bounds = [k*size//parts for k in range(parts+1)]
+	return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def pool_map(function, tasks, workers):
+	"Map function over tasks, using a pool of workers processes, or this process when there is only one worker"
+	if workers == 1 or len(tasks) == 1:
+		return map(function, tasks)
+	pool = Pool(min(workers, len(tasks)))
+	try:
+		return pool.map(function, tasks, 1)
+	finally:
+		pool.close()
+		pool.join()
@@ -0,0 +1,99 @@
+from namespace import *
+from kubo import *
+from integration import *
+from parallel import *
+
+
+class TestPartition(TestCase):
+
+	def testCover(self):
+		self.assertEqual(partition(10, 3), [(0, 3), (3, 6), (6, 10)])
+
+	def testSmall(self):
+		"Workers without elements are left out"
+		self.assertEqual(partition(2, 4), [(0, 1), (1, 2)])
+
+
+class TestParallelRun(TestCase):
+
+	def setUp(self):
+		self.state = KuboAmplitudes(KuboOscillator(0.5), 40)
+		self.state.set_amplitude(1.5)
+		self.state.noise = numpyNoise(seed = 7)
+		self.integrator = semi_implicit_integrator(0.05)
+
+	def integrate(self, workers):
+		result = record(1, ["amplitude_moment"])
+		integrate_in_parallel(self.integrator, self.state, 2, result, workers)
+		return result.results["amplitude_moment"]
+
+	def testMerged(self):
+		"The record has every element of the ensemble, at every sampling time"
+		results = self.integrate(3)
+		self.assertEqual(sorted(results.keys()), [0., 1., 2.])
+		for t in results:
+			self.assertEqual(results[t].values.shape, (40,))
+
+	def testReproducible(self):
+		first, second = self.integrate(2), self.integrate(2)
+		self.assertTrue((first[2.].values == second[2.].values).all())
+
+	def testIndependent(self):
+		"Different parts of the ensemble see different noise"
+		values = self.integrate(2)[2.].values
+		self.assertEqual(len(set(values)), 40)
+
+	def testUnchanged(self):
+		"The state passed in is not integrated itself"
+		self.integrate(2)
+		self.assertEqual(self.state.time, 0.)
+		self.assertTrue((self.state.representations == 1.5).all())
+
+
+class TestCounterNoise(TestCase):
+
+	def testSerial(self):
+		"With counter-based noise, a parallel run matches a serial one exactly"
+		state = KuboAmplitudes(KuboOscillator(0.5), 30)
+		state.set_amplitude(1.5)
+		state.noise = counterNoise(seed = 3, timestep = 0.05)
+		integrate = semi_implicit_integrator(0.05)
+		serial, parallel = record(1, ["amplitude_moment"]), record(1, ["amplitude_moment"])
+		integrate(state, 2, serial)
+		integrate_in_parallel(integrate, state, 2, parallel, 3)
+		for t in 1., 2.:
+			self.assertTrue((serial.results["amplitude_moment"][t].values == parallel.results["amplitude_moment"][t].values).all())
+
+
+
+class TestSweep(TestCase):
+
+	def prepare(self, system):
+		state = KuboAmplitudes(system, 30)
+		state.set_amplitude(1.5)
+		return state
+
+	def integrate(self, integrator, workers):
+		return sweep(KuboOscillator, {'resonance_frequency': [0.5, 1.5]}, self.prepare, counterNoise(5, 0.05), integrator, 2, record(1, ["amplitude_moment"]), workers)
+
+	def testPoints(self):
+		points = self.integrate(semi_implicit_integrator(0.05), 2)
+		self.assertEqual([point for point, result in points], [{'resonance_frequency': 0.5}, {'resonance_frequency': 1.5}])
+		for point, result in points:
+			self.assertEqual(sorted(result.results["amplitude_moment"].keys()), [0., 1., 2.])
+		serial = self.integrate(semi_implicit_integrator(0.05), 1)
+		self.assertTrue((serial[1][1].results["amplitude_moment"][2.].values == points[1][1].results["amplitude_moment"][2.].values).all())
+
+	def testCommon(self):
+		"Every point follows the same Wiener paths, so exact amplitudes differ only by the frequency"
+		(slow, first), (fast, second) = self.integrate(integrate_exactly, 1)
+		for t in 1., 2.:
+			ratio = second.results["amplitude_moment"][t].values/first.results["amplitude_moment"][t].values
+			self.assertTrue(allclose(ratio, exp(1j*t)))
+
+	def testNoise(self):
+		self.assertRaises(AssertionError, sweep, KuboOscillator, {'resonance_frequency': [0.5]}, self.prepare, numpyNoise(3), integrate_exactly, 1, record(1, []))
+
+
+if __name__ == '__main__':
+	run_tests()
@@ -6,7 +6,7 @@ Compute the time derivative and moments of the greens functions.
 
 from namespace import *
 from weightings import Weighting
-from ndmat import ndmat
+from dynamics import weightedEnsemble, weightings
 from adjacencies import *
 
 
@@ -15,9 +15,13 @@ class FermiHubbardSystem:
 	# I remember the physical parameters of the Fermi-Hubbard model, and compute the derivatives of the Greens' function and weight.
 	# Moments are a subclass responsibility.
 
-	"""Parameters: sites, repulsion, hopping, chemical_potential
+	"""Parameters: sites, repulsion, hopping, chemical_potential, and optionally periodic
 	
-	The state is represented as a Weighting, whose value is a 2x[sites]x[sites] array of the up and down greens functions.  Here [sites] is the dimensions of the grid, stored as a tuple."""
+	The state is represented as a Weighting, whose value is a 2x[sites]x[sites] array of the up and down greens functions.  Here [sites] is the dimensions of the grid, stored as a tuple.  If periodic is true, the grid wraps around.
+	
+	A system built from a model on the same grid shares its operators."""
+	
+	periodic = False
 
 	def __init__(self, model = None, **parameters):
 		if model is not None:
@@ -25,61 +29,122 @@ class FermiHubbardSystem:
 		self.__dict__.update(parameters)
 		
 		self.sites = tuple(self.sites)
+		if model is None or (model.sites, model.periodic) != (self.sites, self.periodic):
+			self.prepare_operators()
+		
+	def prepare_operators(self):
+		"""Index the grid once, so that derivatives are whole-array operations.
+		
+		Greens functions are handled as [site_count]x[site_count] matrices, where a site's flat index is its position in sites(self.sites).  Links is the adjacency matrix of the grid, and diagonal indexes the on-site elements.  Pairs holds the flat indices of linked sites, and row k of neighbours lists the sites linked to site k, padded with site_count.  These come from the lattice, which is shared by systems on the same grid."""
+		
+		grid = lattice(self.sites, self.periodic)
+		self.site_count = grid.size
+		self.links = grid.links()
+		self.diagonal = (arange(self.site_count), arange(self.site_count))
+		self.pairs = grid.heads, grid.tails
+		self.neighbours = grid.neighbours
+		
+	def flattened(self, greens):
+		"Reshape greens functions, with any leading ensemble dimensions, to matrices on the flat site index"
+		n = self.site_count
+		return greens.reshape(greens.shape[:greens.ndim-1-2*len(self.sites)] + (2, n, n))
 							
 	def derivative(self, time, state, noise):
-	
-		greens = state.mean
-		noise = array(noise).reshape((2,)+self.sites)
-	
-		def greens_dot(spin):
-			n = greens[spin,::]
-			
-			particles = ndmat(n)
-			holes = ndmat(unit_like(n) - n)
-			
-			return 0.5*(holes*delta(spin, 0)*particles + particles*delta(spin, 1)*holes)
-	
-		def delta(spin, r):
-			
-			def repulsion(site):
-				"Compute |U|(sn_jj-n_jj+1/2)"
-				# FIXME: I'm slow
-				return self.repulsion * greens[(1-spin,)+2*site] \
-					+ abs(self.repulsion) * (0.5 - greens[(spin,)+2*site])
-	
-			f = 1 if spin == 1 else copysign(1, -self.repulsion)
-				
-			result = ndmat(zeros(2*self.sites))
-			for i in sites(self.sites):
-				result[2*i] = -repulsion(i) \
-					- f * sqrt(2*abs(self.repulsion)) * noise[(r,)+i] \
-					+ self.chemical_potential
-			for i, j in adjacencies(self.sites):
-				assert(i != j)
-				result[i+j] = self.hopping
-			return result
-
-		weight_log_dot = \
-			self.hopping * sum([greens[(0,)+i+j] + greens[(1,)+i+j] for i, j in adjacencies(self.sites)]) \
-				+ self.repulsion * (greens[0,::]*greens[1,::]).sum() \
-				- self.chemical_potential * sum([ greens[(0,)+i+i] + greens[(1,)+i+i] for i in sites(self.sites)])
-				
+		"""The state can have a leading ensemble dimension, in which case the weight is an array of the same length, and noise is an array with one row per ensemble element."""
+		greens = self.flattened(state.mean)
+		noise = array(noise).reshape(greens.shape[:-1])
 		return Weighting( \
-			array([greens_dot(0), greens_dot(1)]), \
-			weight = state.weight*weight_log_dot)
+			self.greens_dot(greens, noise).reshape(state.mean.shape), \
+			weight = state.weight*self.weight_log_dot(greens))
+			
+	def repulsion_terms(self, greens):
+		"Compute |U|(sn_jj-n_jj+1/2), indexed by spin and site"
+		occupations = greens[..., self.diagonal[0], self.diagonal[1]]
+		return self.repulsion*occupations[...,::-1,:] + abs(self.repulsion)*(0.5 - occupations)
+		
+	def greens_dot(self, greens, noise):
+		"""The derivatives of flattened greens functions, given noise indexed by process and site.
+		
+		Any leading dimensions of greens and noise are ensemble dimensions, which are handled by broadcasting, so that a whole ensemble is differentiated with batched matrix products.
+		
+		With G the greens function and D_r = hopping*links + diag(potential_r), the derivative is ((1-G) D_0 G + G D_1 (1-G))/2 = (D_0 G + G D_1 - G (D_0+D_1) G)/2.  The products with D are stencils over the neighbours of each site, so only the last product is a dense matrix product."""
+		
+		f = array([copysign(1, -self.repulsion), 1])
+		potential = self.chemical_potential - self.repulsion_terms(greens)[...,:,newaxis,:] \
+			- sqrt(2*abs(self.repulsion)) * f[:,newaxis,newaxis] * noise[...,newaxis,:,:]
+		left, right = potential[...,0,:,newaxis], potential[...,1,newaxis,:]
+		
+		hopped = self.hopping*self.hop(greens)
+		hopped_right = self.hopping*self.hop(greens.swapaxes(-1, -2)).swapaxes(-1, -2)
+		return 0.5*(hopped + left*greens + hopped_right + greens*right - matmul(greens, 2*hopped + (left + right.swapaxes(-1, -2))*greens))
+		
+	def hop(self, greens):
+		"Multiply flattened greens functions on the left by links, by summing the rows of the neighbours of each site"
+		padded = zeros(greens.shape[:-2] + (self.site_count+1, greens.shape[-1]), dtype = greens.dtype)
+		padded[...,:-1,:] = greens
+		result = padded[..., self.neighbours[:,0], :]
+		for k in range(1, self.neighbours.shape[1]):
+			result += padded[..., self.neighbours[:,k], :]
+		return result
+		
+	def weight_log_dot(self, greens):
+		"The derivative of the log weight, for each element of an ensemble of flattened greens functions"
+		down, up = greens[...,0,:,:], greens[...,1,:,:]
+		return self.hopping * (down + up)[..., self.pairs[0], self.pairs[1]].sum(-1) \
+			+ self.repulsion * (down*up).sum(-1).sum(-1) \
+			- self.chemical_potential * greens[..., self.diagonal[0], self.diagonal[1]].sum(-1).sum(-1)
 		
 	def noise_required(self, state):
-		return range(2*reduce(mul, self.sites))
+		return range(2*self.site_count)
 		
 	def moments(self, state):
 		raise 'Subclass responsibility'
 
-	def initial(self, filling):
-		"Answer the state at infinite temperature for given filling"
-		id = zeros(self.sites*2)
-		for i in sites(self.sites):
-			id[i*2] = filling
-		return Weighting(array([id, id]))
+
+	def initial(self, filling, size = None):
+		"""Answer the state at infinite temperature for given filling.
+		
+		If size is given, answer an ensemble of that many copies of the state, with unit weights."""
+		greens = zeros((2, self.site_count, self.site_count))
+		greens[:, self.diagonal[0], self.diagonal[1]] = filling
+		greens = greens.reshape((2,) + 2*self.sites)
+		if size is None:
+			return Weighting(greens)
+		else:
+			return Weighting(greens[newaxis].repeat(size, 0), ones(size))
+
+
+class FermiHubbardGreens(weightedEnsemble):
+
+	"""I store an ensemble of greens functions for a FermiHubbardSystem, as a [size]x2x[sites]x[sites] array with a weight for each element.  All elements are advanced together, by batched matrix products.
+	
+	The noise for element k is processes [k, 0:2*site_count].
+
+Example:
+from dynamics import *
+from integration import *
+from fermi_hubbard import *
+state = FermiHubbardGreens(GreensFermiHubbard(sites = [2,2], repulsion = 0.5, hopping = 1, chemical_potential = 0), 1000)
+state.set_filling(0.5)
+state.noise = numpyNoise()
+semi_implicit_integrator(0.01)(state, 3, record(1, ["greens_moment"]))
+	"""
+
+	def set_filling(self, filling):
+		initial = self.system.initial(filling, self.size)
+		self.representations, self.log_weights = initial.mean, zeros(self.size)
+		
+	def derivative(self, noise):
+		n = self.system.site_count
+		greens = self.system.flattened(self.representations)
+		xi = noise[0:self.size, 0:2*n].reshape((self.size, 2, n))
+		return self.system.greens_dot(greens, xi).reshape(self.representations.shape)
+		
+	def weight_log_derivative(self, noise):
+		return self.system.weight_log_dot(self.system.flattened(self.representations))
+		
+	def greens_moment(self):
+		return weightings(self.representations, log_weights = self.log_weights, signs = self.signs)
 
 
 class CorrelationFermiHubbard(FermiHubbardSystem):
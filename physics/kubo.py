@@ -15,14 +15,16 @@ class KuboOscillator(object):
 		self.w = resonance_frequency
 
 	def expected_amplitude(self, order):
+		"Answer a moment method for E[x^order], x0^order exp(order(iw - order/2)t)"
 		def moment(state):
-			pass		# Kubo formula goes here
+			return state.initial_amplitude**order * exp(order*(1j*self.w - 0.5*order)*state.time)
 		return moment
 
 
 class KuboAmplitudes(ensemble):
 
 	def set_amplitude(self, x0):
+		self.initial_amplitude = x0
 		self.representations = empty_array(self.size)
 		self.representations[:] = x0
 		
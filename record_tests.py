@@ -1,5 +1,8 @@
 from namespace import *
-from dynamics import record
+from numpy import log, errstate, inf
+from dynamics import record, arrayRecord, momentRecord, weightedMoments, weightings, counterNoise, numpyNoise
+from kubo import KuboAmplitudes, KuboOscillator
+from integration import semi_implicit_integrator
 
 
 class TestTimes(TestCase):
@@ -13,6 +16,277 @@ class TestTimes(TestCase):
 			self.assertTrue(returns_float(self.it, method))
 
 
+class TestArrayRecord(TestCase):
+
+	def setUp(self):
+		self.state = KuboAmplitudes(KuboOscillator(0.5), 20)
+		self.state.set_amplitude(1.5)
+		self.state.noise = counterNoise(7, 0.05)
+		self.integrate = semi_implicit_integrator(0.05)
+		self.reference = record(0.5, ["amplitude_moment", "expected_amplitude"])
+		self.integrate(self.state, 1, self.reference)
+		self.integrate(self.state, 1, self.reference)
+		
+	def testSamples(self):
+		"With a capacity, the samples are those a record would keep"
+		columns = arrayRecord(0.5, ["amplitude_moment", "expected_amplitude"], 1, capacity = 40)
+		self.integrate(self.state, 1, columns)
+		self.integrate(self.state, 1, columns)
+		for method in "amplitude_moment", "expected_amplitude":
+			self.assertEqual(sorted(columns.results[method].keys()), sorted(self.reference.results[method].keys()))
+			for t, moment in self.reference.results[method].items():
+				self.assertTrue((columns.results[method][t].values == moment.values).all())
+				self.assertTrue((columns.results[method][t].weights == moment.weights).all())
+				
+	def testSums(self):
+		"Without a capacity, the means and total weights are kept"
+		sums = arrayRecord(0.5, ["amplitude_moment"], 1)
+		self.integrate(self.state, 1, sums)
+		self.integrate(self.state, 1, sums)
+		for t, moment in self.reference.results["amplitude_moment"].items():
+			reduced = sums.results["amplitude_moment"][t]
+			self.assertEqual(reduced.values.shape, (1,))
+			self.assertTrue(allclose(reduced.values, moment.reduced().values))
+			self.assertTrue(allclose(reduced.weights, 40))
+			
+	def testCapacity(self):
+		small = arrayRecord(0.5, ["amplitude_moment"], 1, capacity = 30)
+		self.integrate(self.state, 1, small)
+		self.assertRaises(AssertionError, self.integrate, self.state, 1, small)
+		
+	def testOutside(self):
+		"Times before the start or after the duration are not stored in other rows"
+		sums = arrayRecord(0.5, ["amplitude_moment"], 1, start = 0.5)
+		self.assertRaises(IndexError, sums.incorporate, "amplitude_moment", 0., self.state.amplitude_moment())
+		self.assertRaises(IndexError, self.integrate, self.state, 2, sums)
+		self.assertEqual(sums.index(1.5), 2)
+		
+	def testStart(self):
+		"A record that starts later keys its rows by their own times, before and after merging, and must start on the grid"
+		late = arrayRecord(0.1, ["amplitude_moment"], 1., start = 0.3)
+		self.state.time = 0.3
+		late.add(self.state)
+		self.state.time = 0.5
+		late.add(self.state)
+		self.assertTrue(allclose(sorted(late.results["amplitude_moment"].keys()), [0.3, 0.5]))
+		merged = late.empty()
+		merged.merge(late)
+		self.assertTrue(allclose(sorted(merged.results["amplitude_moment"].keys()), [0.3, 0.5]))
+		self.assertRaises(AssertionError, arrayRecord, 0.1, ["amplitude_moment"], 1., start = 0.05)
+		
+	def testMerge(self):
+		sums = arrayRecord(0.5, ["amplitude_moment"], 1)
+		other = sums.empty()
+		self.integrate(self.state, 1, sums)
+		self.integrate(self.state, 1, other)
+		sums.merge(other)
+		self.assertTrue(allclose(sums.results["amplitude_moment"][1.].weights, 40))
+
+
+class TestExactSamples(TestCase):
+
+	def setUp(self):
+		self.state = KuboAmplitudes(KuboOscillator(0.5), 20)
+		self.state.set_amplitude(1.5)
+		self.state.noise = counterNoise(7, 0.05)
+		
+	def testPath(self):
+		"With a counterNoise, the samples follow the path of exact steps on its grid"
+		times = [0, 0.05, 0.5, 1.0, 1.0, 2.0]
+		samples = self.state.sample_exactly(times)
+		self.assertEqual(samples.shape, (6, 20))
+		final = self.state
+		for t, sample in zip(times, samples):
+			while final.time < t - 0.025:
+				final = final.advanced_exactly(0.05)
+			self.assertTrue(allclose(sample, final.representations))
+		self.assertTrue(allclose(self.state.sample_exactly(times, block = 3), samples))
+		self.assertTrue(allclose(self.state.advanced_exactly(0.5).representations, samples[2]))
+		
+	def testStatistics(self):
+		state = KuboAmplitudes(KuboOscillator(0.5), 20000)
+		state.set_amplitude(1.5)
+		state.noise = numpyNoise(5)
+		times = array([0.3, 1, 2])
+		means = state.sample_exactly(times).mean(1)
+		self.assertTrue(allclose(means, 1.5*exp(times*(0.5j - 0.5)), atol = 0.03))
+		
+	def testBulk(self):
+		"Samples are recorded as if the ensemble had been added at each time"
+		samples = self.state.sample_exactly([0.5, 1.0, 1.5, 2.0])
+		for sink in record(0.5, ["amplitude_moment"]), arrayRecord(0.5, ["amplitude_moment"], 2, capacity = 20):
+			self.state.record_exactly(2, sink)
+			self.assertEqual(sorted(sink.results["amplitude_moment"].keys()), [0.0, 0.5, 1.0, 1.5, 2.0])
+			for t, sample in zip([0.5, 1.0, 1.5, 2.0], samples):
+				self.assertTrue(allclose(sink.results["amplitude_moment"][t].values, sample))
+				
+	def testUnrecorded(self):
+		sink = record(0.5, ["greens_moment"])
+		self.state.record_exactly(2, sink)
+		self.assertEqual(sink.results["greens_moment"], {})
+
+
+class TestExactMoments(TestCase):
+
+	def setUp(self):
+		self.system = KuboOscillator(0.5)
+		
+	def testSamples(self):
+		"The closed forms agree with exact samples"
+		state = KuboAmplitudes(self.system, 40000)
+		state.set_amplitude(0.9 + 0.3j)
+		state.noise = numpyNoise(6)
+		times = array([0.2, 0.7, 1.5])
+		x = state.sample_exactly(times)
+		for p, q in (1, 0), (2, 0), (2, 1), (1, 1), (0, 3):
+			self.assertTrue(allclose((x**p*x.conj()**q).mean(1), self.system.moment(0.9 + 0.3j, p, q, times), atol = 0.03))
+		self.assertTrue(allclose((x[2]*x[0].conj()).mean(), self.system.correlation(0.9 + 0.3j, 1, 1, 1.5, 0.2), atol = 0.03))
+		self.assertTrue(allclose((x[0]**2*x[1].conj()).mean(), self.system.correlation(0.9 + 0.3j, 2, 1, 0.2, 0.7), atol = 0.03))
+		
+	def testBroadcast(self):
+		t = arange(5)[:,newaxis]*0.25
+		s = arange(3)*0.5
+		grid = self.system.correlation(1.5, 1, 1, t, s)
+		self.assertEqual(grid.shape, (5, 3))
+		self.assertTrue(allclose(grid[2,1], self.system.correlation(1.5, 1, 1, 0.5, 0.5)))
+		self.assertTrue(allclose(grid[2,1], 1.5**2))
+		
+	def testMemo(self):
+		times = arange(10)*0.1
+		first = self.system.moment(1.5, 2, 1, times)
+		self.assertTrue(self.system.moment(1.5, 2, 1, times.copy()) is first)
+		self.assertFalse(self.system.moment(1.5, 1, 2, times) is first)
+		self.assertRaises(ValueError, first.__setitem__, 0, 0)
+		
+	def testBounded(self):
+		"The memo keeps the most recently used moments, up to cache_size of them"
+		first, early = self.system.moment(1.5, 1, 0, 0.), self.system.moment(1.5, 1, 0, 0.005)
+		for k in range(3*self.system.cache_size):
+			self.system.moment(1.5, 1, 0, 0.01*(k+1))
+			self.assertTrue(self.system.moment(1.5, 1, 0, 0.) is first)
+		self.assertEqual(len(self.system.cache), self.system.cache_size)
+		self.assertFalse(self.system.moment(1.5, 1, 0, 0.005) is early)
+		
+	def testExpected(self):
+		state = KuboAmplitudes(self.system, 1)
+		state.set_amplitude(1.5)
+		state.time = 2.0
+		self.assertTrue(allclose(state.expected_amplitude().values, 1.5*exp(2.0*(0.5j - 0.5))))
+
+
+class TestMoments(TestCase):
+
+	def setUp(self):
+		source = RandomState(4)
+		self.values = source.normal(size = (50, 3)) + 1j*source.normal(size = (50, 3))
+		self.weights = source.uniform(0.5, 2, 50)
+		self.whole = weightings(self.values, self.weights)
+		
+	def testDirect(self):
+		"The moments agree with numpy, computed from all the samples at once"
+		moments = weightedMoments(self.whole)
+		mean = average(self.values, 0, self.weights)
+		self.assertTrue(allclose(moments.mean(), mean))
+		self.assertTrue(allclose(moments.variance(), average(abs(self.values - mean)**2, 0, self.weights)))
+		self.assertTrue(allclose(moments.effective_size(), self.weights.sum()**2/(self.weights**2).sum()))
+		self.assertTrue(allclose(moments.standard_error(), (moments.variance()/moments.effective_size())**0.5))
+		
+	def testStreaming(self):
+		"Samples can be incorporated a few at a time, and partial results merged"
+		first, second = weightedMoments(), weightedMoments()
+		for k in range(0, 30, 7):
+			first.combine(weightings(self.values[k:min(k+7, 30)], self.weights[k:min(k+7, 30)]))
+		second.combine(weightings(self.values[30:], self.weights[30:]))
+		merged = first.combine(second)
+		whole = weightedMoments(self.whole)
+		self.assertEqual(merged.count, 50)
+		self.assertTrue(allclose(merged.mean(), whole.mean()))
+		self.assertTrue(allclose(merged.variance(), whole.variance()))
+		self.assertTrue(allclose(merged.weight, whole.weight))
+		
+	def testWeightingsMean(self):
+		self.assertTrue(allclose(self.whole.mean(), average(self.values, 0, self.weights)))
+		
+	def testLogWeights(self):
+		"Weights far outside the range of floating point give the same moments as their ratios"
+		huge = weightings(self.values, log_weights = log(self.weights) + 2000)
+		tiny = weightings(self.values, log_weights = log(self.weights) - 2000)
+		whole = weightedMoments(self.whole)
+		for sample in huge, tiny:
+			self.assertTrue(allclose(sample.mean(), self.whole.mean()))
+			moments = weightedMoments(sample)
+			self.assertTrue(allclose(moments.variance(), whole.variance()))
+			self.assertTrue(allclose(moments.effective_size(), whole.effective_size()))
+		self.assertTrue(allclose(huge.reduced().log_weights, log(self.weights.sum()) + 2000))
+		
+	def testScales(self):
+		"Accumulations relative to different scales are combined at the larger"
+		light = weightings(self.values[:25], log_weights = log(self.weights[:25]) - 30)
+		heavy = weightings(self.values[25:], log_weights = log(self.weights[25:]) + 1500)
+		merged = weightedMoments(light).combine(weightedMoments(heavy))
+		self.assertTrue(allclose(merged.mean(), weightedMoments(heavy).mean()))
+		self.assertTrue(allclose(merged.log_weight(), log(self.weights[25:].sum()) + 1500))
+		self.assertEqual(merged.count, 50)
+		
+	def testArrayRecord(self):
+		sums = arrayRecord(0.5, ["moment"], 1)
+		sums.incorporate("moment", 0.5, weightings(self.values[:25], log_weights = log(self.weights[:25]) + 1000))
+		sums.incorporate("moment", 0.5, weightings(self.values[25:], log_weights = log(self.weights[25:]) + 1000))
+		result = sums.results["moment"][0.5]
+		self.assertTrue(allclose(result.mean(), self.whole.mean()))
+		self.assertTrue(allclose(result.log_weights, log(self.weights.sum()) + 1000))
+		
+	def testSigns(self):
+		"Negative weights are kept as signs, and the moments are the signed sums"
+		weights = self.weights.copy()
+		weights[::3] *= -1
+		mixed = weightings(self.values, weights)
+		self.assertTrue(allclose(mixed.weights, weights))
+		mean = average(self.values, 0, weights)
+		self.assertTrue(allclose(mixed.mean(), mean))
+		first, second = weightedMoments(weightings(self.values[:20], weights[:20])), weightedMoments(weightings(self.values[20:], weights[20:]))
+		merged = first.combine(second)
+		self.assertTrue(allclose(merged.mean(), mean))
+		self.assertTrue(allclose(merged.variance(), average(abs(self.values - mean)**2, 0, weights)))
+		self.assertTrue(allclose(merged.reduced().weights, weights.sum()))
+		for capacity in None, 50:
+			columns = arrayRecord(0.5, ["moment"], 1, capacity)
+			columns.incorporate("moment", 0.5, weightings(self.values[:20], log_weights = log(abs(weights[:20])) - 800, signs = mixed.signs[:20]))
+			columns.incorporate("moment", 0.5, weightings(self.values[20:], log_weights = log(abs(weights[20:])) + 700, signs = mixed.signs[20:]))
+			result = columns.results["moment"][0.5]
+			self.assertTrue(allclose(result.mean(), average(self.values[20:], 0, weights[20:])))
+			self.assertTrue(allclose(result.reduced().log_weights, log(abs(weights[20:].sum())) + 700))
+		
+	def testZeroWeights(self):
+		"Zero weights have logs of -inf, and do not count towards the moments"
+		weights = self.weights.copy()
+		weights[:10] = 0
+		with errstate(all = 'raise'):
+			sample = weightings(self.values, weights)
+			self.assertTrue(allclose(sample.mean(), average(self.values[10:], 0, weights[10:])))
+		self.assertTrue((sample.log_weights[:10] == -inf).all())
+		self.assertTrue(sample.signs is None)
+		
+	def testComplexWeights(self):
+		"Complex weights are refused, rather than losing their imaginary parts"
+		self.assertRaises(TypeError, weightings, self.values[:2], array([1+1j, 2j]))
+		self.assertRaises(TypeError, weightings, self.values[:1], 1j)
+		self.assertTrue(allclose(weightings(self.values[:2], array([1, -2])).weights, [1, -2]))
+		
+	def testRecord(self):
+		"A momentRecord keeps the means of the samples that a record keeps"
+		state = KuboAmplitudes(KuboOscillator(0.5), 20)
+		state.set_amplitude(1.5)
+		state.noise = counterNoise(7, 0.05)
+		samples, moments = record(0.5, ["amplitude_moment"]), momentRecord(0.5, ["amplitude_moment"])
+		for result in samples, moments:
+			semi_implicit_integrator(0.05)(state, 1, result)
+			semi_implicit_integrator(0.05)(state.part(0, 10), 1, result)
+		for t, sample in samples.results["amplitude_moment"].items():
+			self.assertTrue(allclose(moments.results["amplitude_moment"][t].mean(), sample.mean()))
+			self.assertTrue(allclose(moments.results["amplitude_moment"][t].reduced().weights, 30))
+
+
 def returns_float(object, method):
 	return isinstance(getattr(object, method)(5), float)
 
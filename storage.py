@@ -0,0 +1,159 @@
+"""Records that live on disk, so that long runs don't hold their results in memory, and results can be analysed while a run is still going.
+
+A stored record is a directory.  The file header.json describes the timestep, the moments, and the layout of their rows.  For each moment there is a file [method].dat, which is appended with one row every time an ensemble is added.  The row holds the time and the weightedMoments of the ensemble, whose weights are relative to exp(log_scale), so the file can be read with numpy.memmap, without copying.
+
+Example:
+from kubo import *
+from integration import *
+from storage import *
+state = KuboAmplitudes(KuboOscillator(0.5), 10000)
+state.set_amplitude(1.5)
+state.noise = numpyNoise()
+semi_implicit_integrator(0.01)(state, 5, fileRecord('kubo_run', 1, ["amplitude_moment"]))
+storedRecord('kubo_run').results['amplitude_moment'][2.0].mean()
+"""
+
+from dynamics import *
+import os
+import json
+from numpy import dtype as data_type, memmap, fromfile
+
+
+class fileRecord(record):
+
+	"""I append the moments of each ensemble added to me to files in directory.  Nothing is kept in memory, apart from the layout of the files."""
+
+	def __init__(self, directory, timestep, methods):
+		self.directory = directory
+		self.timestep = timestep
+		self.methods = list(methods)
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		self.layouts = storedRecord(directory).layouts if os.path.exists(self.header_path()) else {}
+		self.write_header()
+
+	def header_path(self):
+		return os.path.join(self.directory, 'header.json')
+
+	def write_header(self):
+		header = {'timestep': self.timestep, 'methods': self.methods, 'layouts': dict((method, layout.descr) for method, layout in self.layouts.items())}
+		temporary = self.header_path() + '.new'
+		with open(temporary, 'w') as stream:
+			json.dump(header, stream)
+		os.rename(temporary, self.header_path())
+
+	def add(self, state):
+		t = self.nearest(state.time)
+		for method in self.methods:
+			if hasattr(state, method):
+				self.incorporate(method, t, getattr(state, method)())
+
+	def incorporate(self, method, t, moment):
+		"Append a row for the moments of a weightings, or a weightedMoments"
+		moments = weightedMoments(moment)
+		if method not in self.layouts:
+			self.layouts[method] = row_layout(moments.average)
+			self.write_header()
+		elif result_type(self.layouts[method]['mean'].base, moments.average) != self.layouts[method]['mean'].base:
+			self.relayout(method, row_layout(moments.average, self.layouts[method]['mean'].base))
+		row = empty_array(1, dtype = self.layouts[method])
+		row['time'], row['count'], row['weight'], row['square_weight'], row['log_scale'] = t, moments.count, moments.weight, moments.square_weight, moments.log_scale
+		row['mean'], row['spread'] = moments.average, moments.spread
+		with open(self.data_path(method), 'ab') as stream:
+			stream.write(row.tostring())
+
+	def recorded_methods(self):
+		return self.methods
+
+	def relayout(self, method, layout):
+		"Rewrite the rows for method with a wider layout, e.g. when complex amplitudes follow real initial conditions"
+		path = self.data_path(method)
+		old = fromfile(path, dtype = self.layouts[method]) if os.path.exists(path) else zeros(0, dtype = self.layouts[method])
+		new = zeros(old.shape, dtype = layout)
+		for name in layout.names:
+			new[name] = old[name]
+		with open(path + '.new', 'wb') as stream:
+			stream.write(new.tostring())
+		os.rename(path + '.new', path)
+		self.layouts[method] = layout
+		self.write_header()
+
+	@property
+	def results(self):
+		return storedRecord(self.directory).results
+
+	def __getstate__(self):
+		# A checkpoint remembers how many rows there were, so that rows added after it can be discarded on resuming
+		result = self.__dict__.copy()
+		result['row_counts'] = dict((method, os.path.getsize(self.data_path(method)) // layout.itemsize) for method, layout in self.layouts.items())
+		return result
+
+	def __setstate__(self, saved):
+		row_counts = saved.pop('row_counts')
+		self.__dict__.update(saved)
+		self.layouts = storedRecord(self.directory).layouts
+		for method, count in row_counts.items():
+			with open(self.data_path(method), 'r+b') as stream:
+				stream.truncate(count*self.layouts[method].itemsize)
+
+	def data_path(self, method):
+		return os.path.join(self.directory, method + '.dat')
+
+	def empty(self):
+		"Workers of a parallel run accumulate in memory, and are merged into my files"
+		return momentRecord(self.timestep, self.methods)
+
+	def merge(self, other):
+		for method in self.methods:
+			for t, moment in other.results.get(method, {}).items():
+				self.incorporate(method, t, moment)
+
+
+class storedRecord(object):
+
+	"""I read a directory written by a fileRecord.  Rows that are being written are ignored until they are complete."""
+
+	def __init__(self, directory):
+		self.directory = directory
+		with open(os.path.join(directory, 'header.json')) as stream:
+			header = json.load(stream)
+		self.timestep = header['timestep']
+		self.methods = header['methods']
+		self.layouts = dict((method, data_type([field_spec(f) for f in descr])) for method, descr in header['layouts'].items())
+
+	def rows(self, method):
+		"The rows written for method, as a memory-mapped structured array with fields time, count, weight, square_weight, log_scale, mean and spread"
+		path = os.path.join(self.directory, method + '.dat')
+		layout = self.layouts[method]
+		n = os.path.getsize(path) // layout.itemsize
+		if n == 0:
+			return zeros(0, dtype = layout)
+		return memmap(path, dtype = layout, mode = 'r', shape = (n,))
+
+	def moments(self, method):
+		"Answer a mapping of times to the weightedMoments of every row at that time"
+		result = {}
+		for row in self.rows(method):
+			moments = weightedMoments()
+			moments.count, moments.weight, moments.square_weight = int(row['count']), float(row['weight']), float(row['square_weight'])
+			moments.log_scale = float(row['log_scale'])
+			moments.average, moments.spread = array(row['mean']), array(row['spread'])
+			t = float(row['time'])
+			result[t] = result[t].combine(moments) if t in result else moments
+		return result
+
+	@property
+	def results(self):
+		return dict((method, self.moments(method)) for method in self.methods if method in self.layouts)
+
+
+def row_layout(mean, kind = None):
+	"The structured data type of a row, for a moment with the shape and type of mean, widened to kind if that is given"
+	mean = array(mean)
+	kind = mean.dtype if kind is None else result_type(mean, kind)
+	return data_type([('time', 'f8'), ('count', 'i8'), ('weight', 'f8'), ('square_weight', 'f8'), ('log_scale', 'f8'), ('mean', kind, mean.shape), ('spread', 'f8', mean.shape)])
+
+def field_spec(field):
+	"Convert a field description, read back from JSON, to the form numpy.dtype accepts"
+	name, kind = str(field[0]), str(field[1])
+	return (name, kind) if len(field) == 2 else (name, kind, tuple(field[2]))
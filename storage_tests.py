@@ -0,0 +1,84 @@
+from namespace import *
+from kubo import *
+from integration import *
+from parallel import integrate_in_parallel
+import cPickle as pickle
+from storage import *
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+from numpy import log
+
+
+class TestStorage(TestCase):
+
+	def setUp(self):
+		self.directory = os.path.join(mkdtemp(), 'run')
+		self.state = KuboAmplitudes(KuboOscillator(0.5), 20)
+		self.state.set_amplitude(1.5)
+		self.state.noise = counterNoise(7, 0.05)
+		self.integrate = semi_implicit_integrator(0.05)
+		self.reference = momentRecord(0.5, ["amplitude_moment", "expected_amplitude"])
+		self.integrate(self.state, 1, self.reference)
+
+	def tearDown(self):
+		rmtree(os.path.dirname(self.directory))
+
+	def testRoundTrip(self):
+		"Reading the files back gives the moments that a momentRecord keeps"
+		self.integrate(self.state, 1, fileRecord(self.directory, 0.5, ["amplitude_moment", "expected_amplitude"]))
+		stored = storedRecord(self.directory)
+		for method in "amplitude_moment", "expected_amplitude":
+			self.assertEqual(sorted(stored.results[method].keys()), sorted(self.reference.results[method].keys()))
+			for t, moments in self.reference.results[method].items():
+				self.assertTrue(allclose(stored.results[method][t].mean(), moments.mean()))
+				self.assertTrue(allclose(stored.results[method][t].variance(), moments.variance()))
+				self.assertEqual(stored.results[method][t].count, moments.count)
+
+	def testRows(self):
+		"The rows are memory-mapped, and are appended by each run"
+		result = fileRecord(self.directory, 0.5, ["amplitude_moment"])
+		self.integrate(self.state, 1, result)
+		self.assertEqual(len(storedRecord(self.directory).rows("amplitude_moment")), 3)
+		self.integrate(self.state, 1, fileRecord(self.directory, 0.5, ["amplitude_moment"]))
+		rows = storedRecord(self.directory).rows("amplitude_moment")
+		self.assertTrue(isinstance(rows, memmap))
+		self.assertEqual(list(rows['time']), [0., 0.5, 1., 0., 0.5, 1.])
+		self.assertEqual(rows['mean'].dtype.kind, 'c')
+		self.assertEqual(result.results["amplitude_moment"][1.].count, 40)
+
+	def testPartialRow(self):
+		"A row that is still being written is ignored"
+		self.integrate(self.state, 1, fileRecord(self.directory, 0.5, ["amplitude_moment"]))
+		with open(os.path.join(self.directory, "amplitude_moment.dat"), 'ab') as stream:
+			stream.write('\0'*7)
+		self.assertEqual(len(storedRecord(self.directory).rows("amplitude_moment")), 3)
+
+	def testCheckpoint(self):
+		"Rows added after a checkpoint are discarded when the record is restored from it"
+		result = fileRecord(self.directory, 0.5, ["amplitude_moment"])
+		self.integrate(self.state, 0.5, result)
+		saved = pickle.dumps(result)
+		self.integrate(self.state, 1, result)
+		self.assertEqual(len(storedRecord(self.directory).rows("amplitude_moment")), 5)
+		pickle.loads(saved)
+		self.assertEqual(list(storedRecord(self.directory).rows("amplitude_moment")['time']), [0., 0.5])
+
+	def testParallel(self):
+		result = fileRecord(self.directory, 0.5, ["amplitude_moment"])
+		integrate_in_parallel(self.integrate, self.state, 1, result, 2)
+		self.assertTrue(allclose(result.results["amplitude_moment"][1.].mean(), self.reference.results["amplitude_moment"][1.].mean()))
+
+	def testScale(self):
+		"Weights too large for floating point are stored relative to their scale"
+		result = fileRecord(self.directory, 0.5, ["moment"])
+		values, weights = arange(6.), arange(1., 7.)
+		result.incorporate("moment", 0.5, weightings(values[:3], log_weights = log(weights[:3]) + 1000))
+		result.incorporate("moment", 0.5, weightings(values[3:], log_weights = log(weights[3:]) + 900))
+		stored = storedRecord(self.directory).results["moment"][0.5]
+		self.assertTrue(allclose(stored.mean(), average(values[:3], weights = weights[:3])))
+		self.assertTrue(allclose(stored.log_weight(), log(weights[:3].sum()) + 1000))
+
+
+if __name__ == '__main__':
+	run_tests()
@@ -11,7 +11,8 @@
 """
 
 from namespace import *
-from bisect import bisect, bisect_left
+from bisect import bisect, bisect_left, insort
+from numpy import asarray, where
 import string
 from collections import MutableMapping, Callable
 
@@ -23,17 +24,20 @@ class InterpoList(MutableMapping, Callable):
 	def __init__(self, data = {}):
 		""" constructor """
 		self.points = {}
+		self.sampling = []
+		self.arrays = None
 		for x in data:
 			self[x] = data[x]
 			
-	# self.points stores the known points.  subscript operations convert it to a dict, and interpolation to a sorted list of (abscissa, ordinate) pairs.
+	# self.points stores the known points, and self.sampling their abscissae in order, which subscript operations keep up to date.  Self.arrays holds the abscissae and ordinates as arrays, for interpolating arrays of abscissae.  It is built when it is needed, and discarded when a point changes.
 		
 	def be_table(self):
-		self.sampling = None
+		self.arrays = None
 		
 	def be_sorted(self):
-		self.sampling = self.points.keys()
-		self.sampling.sort()
+		if self.arrays is None:
+			self.arrays = array(self.sampling), array([self.points[x] for x in self.sampling])
+		return self.arrays
 		
 	def series(self, i):
 		"""return the ith sample point."""
@@ -41,7 +45,6 @@ class InterpoList(MutableMapping, Callable):
 		
 	def points_around(self, x):
 		"""if x was sampled, return it.  otherwise, return the sampled abscissae either side x."""
-		self.be_sorted()
 		abscissa = float(x)
 		if self.extrapolation(abscissa):
 			raise IndexError("Extrapolation is not supported")
@@ -60,17 +63,33 @@ class InterpoList(MutableMapping, Callable):
 		
 	def extrapolation(self, abscissa):
 		""" Is abscissa outside the domain of my data? """
-		self.be_sorted()
 		return self.sampling[0] > abscissa or self.sampling[-1] < abscissa
 
 	def __call__(self, x):
-		""" Returns the value interpolated for a given abscissa """
+		""" Returns the value interpolated for a given abscissa, or an array of values for an array of them """
+		if isinstance(x, ndarray):
+			return self.interpolate(x)
 		neighbours = self.points_around(x)
 		if len(neighbours) is 1:
 			return neighbours[0][1]
 		else:
 			return self.ordinate(x, neighbours)
 			
+	def interpolate(self, x):
+		""" Interpolate an array of abscissae, with one search of the sorted abscissae.  Ordinates can be arrays, in which case the result has their shape after that of x. """
+		abscissae, ordinates = self.be_sorted()
+		x = asarray(x, dtype = float)
+		if x.size and (x.min() < abscissae[0] or x.max() > abscissae[-1]):
+			raise IndexError("Extrapolation is not supported")
+		post = abscissae.searchsorted(x)
+		hit = abscissae[post] == x
+		pre = where(hit, post, post - 1)
+		span = where(hit, 1., abscissae[post] - abscissae[pre])
+		shape = x.shape + (1,)*(ordinates.ndim - 1)
+		before = where(hit, 1., (abscissae[post] - x)/span).reshape(shape)
+		after = where(hit, 0., (x - abscissae[pre])/span).reshape(shape)
+		return ordinates[pre]*before + ordinates[post]*after
+			
 	def derivative(self, x):
 		""" Returns the derivative of the interpolated function at a given abscissa.  doesn't try hard at sampled points"""
 		neighbours = self.points_around(x)
@@ -84,17 +103,21 @@ class InterpoList(MutableMapping, Callable):
 	def __setitem__(self, key, value):
 		""" adds a new keypoint or replaces a current one """
 		self.be_table()
-		self.points[float(key)] = value
+		key = float(key)
+		if key not in self.points:
+			insort(self.sampling, key)
+		self.points[key] = value
 			
 	def __getitem__(self, key):
 		""" Answers the value stored for key, if there is one """
-		self.be_table()
 		return self.points[float(key)]
 
 	def __delitem__(self, key):
 		""" Deletes a given keypoint """
+		key = float(key)
+		del self.points[key]
 		self.be_table()
-		del self.points[float(key)]
+		del self.sampling[bisect_left(self.sampling, key)]
 
 	def __len__(self):
 		""" Returns the range of the indices """
@@ -106,7 +129,6 @@ class InterpoList(MutableMapping, Callable):
 	def __repr__(self):
 		""" Formal description of the object """
 		# Dump the contents into a dict style string
-		self.be_sorted()
 		lst = string.join([string.join( (str(x), str(self.points[x]) ), ":") for x in self.sampling], ",")
 		# spit the whole thing out
 		return "%s(data={%s})" % (type(self).__name__, lst)
@@ -207,6 +229,37 @@ class TestReversion(TestCase):
 		self.assertTrue(self.mapping(0) < 1e-10)
 		
 		
+class TestArrays(TestCase):
+
+	def setUp(self):
+		self.mapping = InterpoList(data = {-1:-1, 0:7, 1:1, 2.5:4})
+		
+	def testScalars(self):
+		""" Interpolating an array agrees with interpolating its elements """
+		x = arange(-1, 2.5, 0.01)
+		self.assertTrue(allclose(self.mapping(x), [self.mapping(t) for t in x]))
+		self.assertEqual(self.mapping(array([-1., 0., 2.5])).tolist(), [-1, 7, 4])
+		self.assertEqual(self.mapping(zeros((2, 3))).shape, (2, 3))
+		
+	def testVectors(self):
+		""" Ordinates can be arrays """
+		vectors = InterpoList(data = {0: array([0., 1.]), 2: array([4., -1.])})
+		self.assertTrue(allclose(vectors(array([0.5, 2.])), [[1., 0.5], [4., -1.]]))
+		
+	def testChanges(self):
+		""" The sorted abscissae follow additions and deletions """
+		self.mapping(array([0.5]))
+		self.mapping[0.5] = 0
+		self.mapping[-3] = 2
+		del self.mapping[1]
+		self.mapping[2.5] = 5
+		self.assertEqual(self.mapping.sampling, [-3, -1, 0, 0.5, 2.5])
+		self.assertEqual(self.mapping(array([0.5, 1.5, -2])).tolist(), [0, 2.5, 0.5])
+		
+	def testExtrapolation(self):
+		self.assertRaises(IndexError, self.mapping, array([0, 3]))
+		
+
 class TestDerivative(TestCase):
 	def setUp(self):
 		self.mapping = InterpoList(data = {-1:0, 0:7, 1:0})
@@ -3,6 +3,7 @@
 # resp, 2011-10-05
 
 from namespace import *
+from numpy import indices, ravel_multi_index, bincount, cumsum, concatenate
 
 def adjacencies(dimensions):
 	"""Yield pairs of adjacent sites in the given grid"""
@@ -20,6 +21,64 @@ def sites(dimensions):
 	return cartesian_product(*axes)
 	
 	
+class lattice(object):
+	"""The sites of a grid, and the pairs of adjacent sites, as integer arrays.
+	
+	A site's flat index is its position in sites(dimensions).  Coordinates[k] is the site with flat index k.  Heads and tails are the flat indices of adjacent pairs, in both orders.  Row k of neighbours lists the sites adjacent to site k, padded with size.  If periodic, the grid wraps around in every dimension longer than 2.
+	
+	Lattices are memoised by dimensions and periodic, so the arrays are shared, and must not be modified."""
+	
+	cache = {}
+	
+	def __new__(cls, dimensions, periodic = False):
+		key = (tuple(dimensions), bool(periodic))
+		if key not in cls.cache:
+			instance = object.__new__(cls)
+			instance.build(*key)
+			cls.cache[key] = instance
+		return cls.cache[key]
+		
+	def build(self, dimensions, periodic):
+		self.dimensions, self.periodic = dimensions, periodic
+		self.size = reduce(mul, dimensions, 1)
+		self.coordinates = indices(dimensions).reshape((len(dimensions), self.size)).T
+		heads, tails = [zeros(0, dtype = int)], [zeros(0, dtype = int)]
+		for i, n in enumerate(dimensions):
+			shifted = self.coordinates.copy()
+			shifted[:,i] += 1
+			if periodic and n > 2:
+				shifted[:,i] %= n
+			inside = shifted[:,i] < n
+			heads.append(arange(self.size)[inside])
+			tails.append(self.flat(shifted[inside]))
+		heads, tails = concatenate(heads), concatenate(tails)
+		self.heads, self.tails = append(heads, tails), append(tails, heads)
+		self.neighbours = self.neighbour_table()
+		self.adjacency = None
+		
+	def flat(self, coordinates):
+		"The flat indices of an array of coordinates, whose last dimension indexes the dimensions of the grid"
+		coordinates = array(coordinates)
+		return ravel_multi_index(tuple(coordinates[...,i] for i in range(len(self.dimensions))), self.dimensions)
+		
+	def neighbour_table(self):
+		order = self.heads.argsort(kind = 'mergesort')
+		heads, tails = self.heads[order], self.tails[order]
+		degrees = bincount(heads, minlength = self.size)
+		starts = cumsum(degrees) - degrees
+		table = zeros((self.size, max([1] + list(degrees))), dtype = int) + self.size
+		table[heads, arange(len(heads)) - starts[heads]] = tails
+		return table
+		
+	def links(self):
+		"The adjacency matrix, on flat indices.  This is built the first time it is asked for."
+		if self.adjacency is None:
+			self.adjacency = zeros((self.size, self.size))
+			self.adjacency[self.heads, self.tails] = 1
+			self.adjacency.flags.writeable = False
+		return self.adjacency
+		
+	
 ### Tests	
 	
 class SitesTest(TestCase):
@@ -36,6 +95,34 @@ class AdjacenciesTest(TestCase):
 	def testTwo(self):
 		self.assertEqual(len(set(adjacencies([2,3]))), 14)
 		self.assertTrue(((1, 1), (1, 2)) in adjacencies([2,3]))
+		
+		
+class LatticeTest(TestCase):
+	def testAdjacencies(self):
+		"The pairs are the adjacencies, on flat indices"
+		grid = lattice([2,3])
+		flat = dict((site, k) for k, site in enumerate(sites([2,3])))
+		self.assertEqual(set(zip(grid.heads, grid.tails)), set((flat[i], flat[j]) for i, j in adjacencies([2,3])))
+		self.assertEqual([tuple(x) for x in grid.coordinates], list(sites([2,3])))
+		self.assertEqual(list(grid.flat(grid.coordinates)), range(6))
+		
+	def testNeighbours(self):
+		grid = lattice([3,4])
+		for k in range(grid.size):
+			self.assertEqual(set(grid.neighbours[k]) - set([grid.size]), set(grid.tails[grid.heads == k]))
+			
+	def testPeriodic(self):
+		"Every site of a periodic grid has 2 neighbours per dimension, except along dimensions too short to wrap"
+		self.assertTrue((lattice([3,4], True).neighbours < 12).all())
+		self.assertEqual(lattice([3,4], True).neighbours.shape, (12, 4))
+		self.assertEqual(len(lattice([2,4], True).heads), 2*(4 + 8))
+		self.assertEqual(len(lattice([1], True).heads), 0)
+		self.assertEqual(lattice([1], True).neighbours.shape, (1, 1))
+		
+	def testMemo(self):
+		self.assertTrue(lattice((2,3)) is lattice([2,3]))
+		self.assertTrue(lattice((2,3)).links() is lattice([2,3]).links())
+		self.assertFalse(lattice((2,3)) is lattice([2,3], True))
 
 if __name__ == '__main__':
 	run_tests()
@@ -0,0 +1,76 @@
+# The Philox4x32-10 counter-based random number generator, after Salmon et al, "Parallel random numbers: as easy as 1, 2, 3", SC11.
+#
+# Each 4-word counter is hashed to 4 random words, independently of every other counter, so any part of a random sequence can be generated on demand.
+
+from namespace import *
+from numpy import uint64, uint32, log, cos, sin, pi
+
+MASK = uint64(0xffffffff)
+MULTIPLIERS = uint64(0xD2511F53), uint64(0xCD9E8D57)
+WEYL = uint64(0x9E3779B9), uint64(0xBB67AE85)
+
+def philox(counters, key, rounds = 10):
+	"""Answer the random words for an array of counters, whose last dimension has length 4.  The key is a pair of 32 bit integers."""
+	counters = array(counters, dtype = uint64)
+	c0, c1, c2, c3 = [counters[...,i] for i in range(4)]
+	k0, k1 = uint64(key[0]), uint64(key[1])
+	for r in range(rounds):
+		if r > 0:
+			k0, k1 = (k0 + WEYL[0]) & MASK, (k1 + WEYL[1]) & MASK
+		p0, p1 = MULTIPLIERS[0]*c0, MULTIPLIERS[1]*c2
+		c0, c1, c2, c3 = (p1 >> uint64(32)) ^ c1 ^ k0, p1 & MASK, (p0 >> uint64(32)) ^ c3 ^ k1, p0 & MASK
+	result = empty_array(counters.shape, dtype = uint32)
+	for i, c in enumerate([c0, c1, c2, c3]):
+		result[...,i] = c
+	return result
+
+def gaussians(counters, key):
+	"""Answer 4 independent normal deviates for each counter, by the Box-Muller method."""
+	u = (philox(counters, key) + 0.5) / 2.**32
+	r = (-2*log(u[...,0::2]))**0.5
+	theta = 2*pi*u[...,1::2]
+	result = empty_array(u.shape)
+	result[...,0::2] = r*cos(theta)
+	result[...,1::2] = r*sin(theta)
+	return result
+
+def split_key(seed):
+	"Answer a Philox key, from a seed of up to 64 bits"
+	return seed & 0xffffffff, (seed >> 32) & 0xffffffff
+
+
+### Tests
+
+class KnownAnswerTest(TestCase):
+	"Test vectors from the Random123 distribution"
+
+	def check(self, counter, key, expected):
+		self.assertEqual(list(philox(counter, key)), expected)
+
+	def testZero(self):
+		self.check([0, 0, 0, 0], [0, 0], [0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8])
+
+	def testOnes(self):
+		self.check(4*[0xffffffff], 2*[0xffffffff], [0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd])
+
+	def testPi(self):
+		self.check([0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344], [0xa4093822, 0x299f31d0], [0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1])
+
+
+class GaussianTest(TestCase):
+
+	def setUp(self):
+		counters = zeros((20000, 4), dtype = int)
+		counters[:,0] = range(20000)
+		self.samples = gaussians(counters, split_key(7)).flatten()
+
+	def testMoments(self):
+		self.assertTrue(abs(self.samples.mean()) < 0.02)
+		self.assertTrue(abs(self.samples.var() - 1) < 0.02)
+
+	def testBatch(self):
+		"Generating counters one at a time, or all at once, gives the same deviates"
+		self.assertTrue((gaussians([5, 0, 0, 0], split_key(7)) == self.samples[20:24]).all())
+
+if __name__ == '__main__':
+	run_tests()
@@ -0,0 +1,46 @@
+"""A value, or an array of values, with a weight.  States of physical systems are represented as Weightings, so that the derivative of the weight is computed alongside the derivative of the value.  See tests/weighting_test.py."""
+
+from namespace import *
+
+
+class Weighting(object):
+
+	"""I store a mean and a weight.  Arithmetic acts on both, elementwise, and combine takes the weighted average of two Weightings."""
+
+	def __init__(self, mean, weight = 1):
+		self.mean = mean
+		self.weight = weight
+
+	def __add__(self, other):
+		return Weighting(self.mean + other.mean, self.weight + other.weight)
+
+	def __mul__(self, scalar):
+		return Weighting(self.mean*scalar, self.weight*scalar)
+
+	__rmul__ = __mul__
+
+	def __div__(self, scalar):
+		return Weighting(self.mean/scalar, self.weight/scalar)
+
+	__truediv__ = __div__
+
+	def __eq__(self, other):
+		return isinstance(other, Weighting) and array(self.mean == other.mean).all() and array(self.weight == other.weight).all()
+
+	def __ne__(self, other):
+		return not self == other
+
+	def combine(self, other):
+		"The weighted average of me and other, weighted by our total weight"
+		if other.weight == 0:
+			return self
+		total = self.weight + other.weight
+		return Weighting((self.weight*self.mean + other.weight*other.mean)/total, total)
+
+
+def weightclose(a, b):
+	return allclose(a.mean, b.mean) and allclose(a.weight, b.weight)
+
+
+if __name__ == '__main__':
+	run_tests()
@@ -0,0 +1,123 @@
+from namespace import *
+from dynamics import *
+from integration import *
+from numpy import diag, vdot
+from math import factorial, pi
+
+
+def fock_state(phi, alpha, cutoff = 40):
+	"The single-mode coherent state exp(phi + alpha a^+)|0>, in the number basis"
+	return exp(phi) * array([alpha**n/sqrt(factorial(n)) for n in range(cutoff)])
+
+def creation(cutoff = 40):
+	return diag(array([sqrt(n) for n in range(1, cutoff)]), -1)
+
+
+class TestKernel(TestCase):
+
+	def setUp(self):
+		self.state = VCMEnsemble(QuarticOscillator(), 4)
+		self.state.representations = array([[0.1, 0.8], [-0.2j, 0.7j], [0.05, -0.6-0.1j], [0, -0.8j]])
+		a_dagger = creation()
+		self.vectors = []
+		for phi, alpha in self.state.representations:
+			psi = fock_state(phi, alpha)
+			self.vectors += [psi, matmul(a_dagger, psi)]
+		self.quartic = matmul(matmul(a_dagger, a_dagger), matmul(a_dagger.T, a_dagger.T))
+		
+	def testOverlaps(self):
+		rho = exp(self.state.logrho())
+		for i in range(4):
+			for j in range(4):
+				self.assertTrue(allclose(rho[i,j], vdot(self.vectors[2*i], self.vectors[2*j])))
+		
+	def testMetric(self):
+		"V is the Gram matrix of the derivatives of the coherent states by their parameters"
+		V = self.state.V()
+		for k, u in enumerate(self.vectors):
+			for l, v in enumerate(self.vectors):
+				self.assertTrue(allclose(V[k,l], vdot(u, v)))
+				
+	def testHamiltonian(self):
+		"H[i,a] is the sum of <psi_i|H|psi_j> e_ja"
+		H = self.state.H()
+		for i in range(4):
+			for a in range(2):
+				self.assertTrue(allclose(H[i,a], sum([vdot(self.vectors[2*i], matmul(self.quartic, self.vectors[2*j]))*self.state.representations[j,a]**a for j in range(4)])))
+				
+	def testWorkspace(self):
+		"The workspaces are reused, and shared with spare ensembles"
+		workspace = self.state.V().base
+		spare = self.state.spare()
+		spare.representations[:] = self.state.representations
+		self.assertTrue(spare.V().base is workspace)
+		self.assertTrue(self.state.V().base is workspace)
+		self.state.representations = zeros((6, 3))
+		self.assertEqual(self.state.V().shape, (18, 18))
+		
+	def testProjection(self):
+		"R[i,a] is <d_ia psi_i|H|psi>"
+		R = self.state.R()
+		H_psi = matmul(self.quartic, sum(self.vectors[0::2]))
+		for k, u in enumerate(self.vectors):
+			self.assertTrue(allclose(R.flatten()[k], vdot(u, H_psi)))
+			
+	def testVariational(self):
+		"The error in the derivative of psi is orthogonal to the tangent space"
+		dx = self.state.derivative(None)
+		error = sum([d*u for d, u in zip(dx.flatten(), self.vectors)]) + 1j*matmul(self.quartic, sum(self.vectors[0::2]))
+		for u in self.vectors:
+			self.assertTrue(abs(vdot(u, error)) < 1e-8)
+		
+		
+class TestPropagation(TestCase):
+
+	def setUp(self):
+		self.state = VCMEnsemble(QuarticOscillator(), 3)
+		self.state.representations = zeros((3, 2), dtype = complex)
+		self.state.representations[:,1] = 0.7*exp(2j*pi*arange(3)/3)
+		
+	def norm_and_energy(self, state):
+		rho = exp(state.logrho())
+		return rho.sum(), (rho*state.system.ev_H(state.alphas())).sum()
+		
+	def testConservation(self):
+		"Variational propagation conserves the norm and the energy"
+		result = record(0.05, ["norm_and_energy"])
+		self.state.norm_and_energy = lambda: self.norm_and_energy(self.state)
+		before = self.norm_and_energy(self.state)
+		integrate = semi_implicit_integrator(0.002)
+		final = integrate.advance(self.state)
+		for i in range(49):
+			final = integrate.advance(final)
+		after = self.norm_and_energy(final)
+		self.assertTrue(abs(final.time - 0.1) < 1e-12)
+		self.assertTrue(allclose(after, before, 1e-4))
+		self.assertTrue(abs(final.representations - self.state.representations).max() > 1e-2)
+		
+	def testReuse(self):
+		"Reusing the decomposition for the iterations of the midpoint gives the same results as decomposing every time"
+		self.state.workspace = vcmKernel(tolerance = -1)
+		integrate = semi_implicit_integrator(0.002)
+		fresh = integrate.advance(integrate.advance(self.state)).representations.copy()
+		self.state.workspace = vcmKernel()
+		integrate = semi_implicit_integrator(0.002)
+		reused = integrate.advance(integrate.advance(self.state))
+		self.assertTrue(allclose(reused.representations, fresh, 1e-9, 1e-12))
+		self.assertEqual(self.state.workspace.factorizations, 4)
+		
+	def testShared(self):
+		"The integrator's ensembles share the kernel, even if it was not made before integrating"
+		integrate = semi_implicit_integrator(0.002)
+		integrate.advance(integrate.advance(self.state))
+		self.assertEqual(self.state.kernel().factorizations, 4)
+		
+	def testSingular(self):
+		"Repeated coherent states make V singular, which is regularised"
+		self.state.representations[2] = self.state.representations[0]
+		dx = self.state.derivative(None)
+		self.assertTrue(abs(dx).max() < 1e6)
+		
+
+if __name__ == '__main__':
+	run_tests()